@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Room adjacency graph: which rooms of a level share a wall and along which interval
+
+    python cfast_adjacency.py building.svg --format json -o building_adjacency.json
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+
+import cfast_fixed
+from cfast_fixed import to_units, to_metres, snap_from_env, SNAP_ENV
+from export_cfast_geometry import CfastProcessing, CfastBuilding, Segment
+from cfast_batch_export import load_document
+from cfast_model import load_model, is_model, MODEL_SUFFIX
+
+FORMATS = ('json', 'edges')
+
+class CfastSharedWall:
+    '''
+    Общий участок стены двух помещений одного этажа
+
+    orientation - Segment.VERTICAL (стена x = coordinate, участок по y)
+                  или Segment.HORISONTAL (стена y = coordinate, участок по x)
+    comp_ids - помещения по обе стороны: первое левее (ниже) стены, второе правее (выше)
+    '''
+    __slots__ = ('level', 'comp_ids', 'orientation', 'coordinate', 'start', 'end')
+
+    def __init__(self, level, comp_ids:tuple, orientation:int, coordinate:float, start:float, end:float):
+        self.level = level
+        self.comp_ids = comp_ids
+        self.orientation = orientation
+        self.coordinate = coordinate
+        self.start = start
+        self.end = end
+
+    @property
+    def length(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        r = lambda value: round(value, 4)
+        return {'level': self.level, 'comp_ids': list(self.comp_ids),
+                'orientation': 'vertical' if self.orientation == Segment.VERTICAL else 'horizontal',
+                'coordinate': r(self.coordinate), 'start': r(self.start), 'end': r(self.end), 'length': r(self.length)}
+
+'''
+Общие участки стен помещений одного этажа
+
+rects - (id, x0, y0, ширина, глубина) в порядке помещений. Стороны помещений строятся
+из габаритов в целых миллиметрах (cfast_fixed.box_of) и группируются по прямым
+(x = const для вертикальных, y = const для горизонтальных): соседние по координате
+стороны, которые расходятся не больше чем на snap плюс погрешность округления ROUNDING,
+попадают в одну группу. Группа может растянуться цепочкой на любое расстояние, поэтому
+в ней стену образуют только две стороны, координаты которых сами расходятся не больше
+допуска. Погрешность ROUNDING нужна и при snap = 0: начало и размер прямоугольника
+квантуются отдельно, и совпадающие на чертеже стороны могут разойтись на 1 мм.
+В группе участки просматриваются по возрастанию начала. Активными остаются только
+участки, которые еще не закончились, поэтому сравниваются лишь перекрывающиеся стороны:
+O(n log n) на сортировку плюс количество найденных стен
+'''
+def shared_walls(rects:list, level=None, snap:int=cfast_fixed.DEFAULT_SNAP) -> list:
+    vertical = []
+    horizontal = []
+    for i, (comp_id, x0, y0, width, depth) in enumerate(rects):
+        bx0, by0, bx1, by1 = cfast_fixed.box_of(x0, y0, width, depth)
+        # side 0 - помещение слева (снизу) от прямой, side 1 - справа (сверху)
+        vertical.append((bx1, by0, by1, 0, i))
+        vertical.append((bx0, by0, by1, 1, i))
+        horizontal.append((by1, bx0, bx1, 0, i))
+        horizontal.append((by0, bx0, bx1, 1, i))
+
+    walls = []
+    tolerance = snap + cfast_fixed.ROUNDING
+    for orientation, sides in ((Segment.VERTICAL, vertical), (Segment.HORISONTAL, horizontal)):
+        sides.sort()
+        line_start = 0
+        for k in range(1, len(sides) + 1):
+            if k == len(sides) or sides[k][0] - sides[k - 1][0] > tolerance:
+                sweep_line(sides[line_start:k], rects, level, orientation, snap, walls)
+                line_start = k
+    return walls
+
+def sweep_line(sides:list, rects:list, level, orientation:int, snap:int, walls:list) -> None:
+    tolerance = snap + cfast_fixed.ROUNDING
+    active = ([], [])
+    for coordinate, start, end, side, i in sorted(sides, key=lambda s: (s[1], s[2])):
+        others = active[1 - side]
+        while others and others[0][0] <= start + snap:
+            heapq.heappop(others)
+        for other_end, j, other_coordinate in others:
+            if abs(coordinate - other_coordinate) > tolerance: continue
+            wall_end = min(end, other_end)
+            if wall_end - start > snap:
+                left, right = (i, j) if side == 0 else (j, i)
+                walls.append(CfastSharedWall(level, (rects[left][0], rects[right][0]), orientation,
+                                             to_metres((coordinate + other_coordinate) / 2),
+                                             to_metres(start), to_metres(wall_end)))
+        heapq.heappush(active[side], (end, i, coordinate))
+
+class CfastAdjacency:
+    '''
+    Граф смежности помещений здания по общим стенам
+    '''
+    def __init__(self, walls:list):
+        self.walls = walls
+        self._neighbours = None
+
+    # snap - допуск касания в миллиметрах, как у CfastProcessing
+    @classmethod
+    def from_building(cls, building:CfastBuilding, snap:int=cfast_fixed.DEFAULT_SNAP):
+        level_ids = {to_units(level[1]): level[0] for level in building.levels}
+        levels = {}
+        for comp in building.comparaments:
+            x, y, z = comp.origin
+            levels.setdefault(to_units(z), []).append((comp.id, x, y, comp.width, comp.depth))
+        walls = []
+        for z, rects in levels.items():
+            walls.extend(shared_walls(rects, level_ids.get(z, to_metres(z)), snap))
+        return cls(walls)
+
+    '''
+    Соседние помещения: id -> {id соседа: [общие участки стен]}
+    '''
+    def neighbours(self) -> dict:
+        if self._neighbours is None:
+            self._neighbours = {}
+            for wall in self.walls:
+                a, b = wall.comp_ids
+                self._neighbours.setdefault(a, {}).setdefault(b, []).append(wall)
+                self._neighbours.setdefault(b, {}).setdefault(a, []).append(wall)
+        return self._neighbours
+
+    def walls_between(self, comp_a:str, comp_b:str) -> list:
+        return self.neighbours().get(comp_a, {}).get(comp_b, [])
+
+    '''
+    Ребра графа: (помещение, помещение, суммарная длина общих стен) в порядке обнаружения
+    '''
+    def edges(self) -> list:
+        lengths = {}
+        for wall in self.walls:
+            lengths[wall.comp_ids] = lengths.get(wall.comp_ids, 0.0) + wall.length
+        return [(a, b, round(length, 4)) for (a, b), length in lengths.items()]
+
+    def to_json(self) -> dict:
+        return {'walls': [wall.to_dict() for wall in self.walls],
+                'edges': [list(edge) for edge in self.edges()]}
+
+    def write_json(self, stream) -> None:
+        json.dump(self.to_json(), stream, ensure_ascii=False, indent=2)
+        stream.write('\n')
+
+    def write_edge_list(self, stream) -> None:
+        for a, b, length in self.edges():
+            stream.write('{} {} {}\n'.format(a, b, length))
+
+def main(argv:list=None) -> int:
+    pars = argparse.ArgumentParser(description='Room adjacency graph of a building by shared walls')
+    pars.add_argument('path', help='SVG document or {} file with the building'.format(MODEL_SUFFIX))
+    pars.add_argument('-f', '--format', dest='format', choices=FORMATS, default='json',
+                      help='json: walls and edges, edges: "room room length" per line')
+    pars.add_argument('-o', '--output', dest='output', default=None, help='output file (default: stdout)')
+    pars.add_argument('--snap', dest='snap', type=int, default=None,
+                      help='snap tolerance in millimetres, as in the export (default: ${} or 0)'.format(SNAP_ENV))
+    opt = pars.parse_args(argv)
+    snap = snap_from_env() if opt.snap is None else max(0, opt.snap)
+
+    if is_model(opt.path):
+        building = load_model(opt.path)
+    else:
+        building = CfastProcessing(snap=snap).building(load_document(opt.path), os.path.basename(opt.path))
+    graph = CfastAdjacency.from_building(building, snap)
+
+    stream = open(opt.output, 'w', encoding='utf-8') if opt.output else sys.stdout
+    try:
+        if opt.format == 'json':
+            graph.write_json(stream)
+        else:
+            graph.write_edge_list(stream)
+    finally:
+        if opt.output:
+            stream.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batch export of many SVG documents to CFAST (.in) and Smokeview (.smv) files
+without Inkscape. Saved building models (.cfastmodel) are accepted as input
+and are written again without parsing and mapping
+
+    python cfast_batch_export.py buildings/ -o out/ --formats in,smv --jobs 8
+"""
+
+import argparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import inkex
+from export_cfast_geometry import CfastProcessing, profiled
+from export_cfast_bundle import FORMATS, DEFAULT_FORMATS, STREAM_FORMATS
+from cfast_mapping_cache import open_cache
+from cfast_model import load_model, is_model, MODEL_SUFFIX
+from cfast_validation import validated
+from cfast_fixed import SNAP_ENV
+
+'''
+Сбор списка svg-файлов и файлов моделей из переданных файлов и директорий
+'''
+def collect_svg_files(paths:list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(('.svg', MODEL_SUFFIX)))
+        else:
+            files.append(path)
+    return files
+
+'''
+Загрузка документа: этажи собираются обходом слоев, как и в расширении Inkscape
+'''
+def load_document(svg_path:str):
+    return inkex.load_svg(svg_path).getroot()
+
+'''
+Экспорт одного документа
+
+Выполняется в отдельном процессе, поэтому возвращает только простые данные:
+время каждого этапа, количество помещений и проемов или текст ошибки
+'''
+def export_file(svg_path:str, output_dir:str, formats:tuple, use_cache:bool=True, level_jobs:int=1,
+                profile:bool=False, streaming:bool=False, snap:int=None) -> dict:
+    result = {'file': svg_path, 'timings': {}, 'outputs': [], 'warnings': [], 'error': None}
+    timings = result['timings']
+    svg_name = os.path.basename(svg_path)
+    stem = os.path.splitext(svg_name)[0]
+    out_dir = output_dir or os.path.dirname(svg_path)
+    try:
+        with profiled(os.path.join(out_dir, stem + '.prof') if profile else None):
+            t = time.perf_counter()
+            if is_model(svg_path):
+                building = load_model(svg_path)
+                timings['parse'] = time.perf_counter() - t
+            else:
+                document = load_document(svg_path)
+                timings['parse'] = time.perf_counter() - t
+
+                cache = open_cache(svg_path) if use_cache else None
+                processing = CfastProcessing(jobs=level_jobs, snap=snap)
+                if streaming:
+                    # Все форматы записываются за один проход по этажам
+                    out_paths = [os.path.join(out_dir, '{}.{}'.format(stem, fmt)) for fmt in formats]
+                    with ExitStack() as files, validated(document, result['warnings'].append, snap):
+                        writers = [STREAM_FORMATS[fmt](files.enter_context(open(out_path, 'wb')), svg_name)
+                                   for fmt, out_path in zip(formats, out_paths)]
+                        processing.stream(document, writers, cache)
+                    result['outputs'] = out_paths
+                    result['comps'] = sum(level[2] for level in processing.stats.levels)
+                    result['vents'] = sum(level[4] for level in processing.stats.levels)
+                    building = None
+                else:
+                    with validated(document, result['warnings'].append, snap):
+                        building = processing.building(document, svg_name, cache)
+                if cache is not None:
+                    if not cache.save():
+                        result['warnings'].append('cache not saved: {}'.format(cache.error))
+                    result['cached_levels'] = cache.hits
+                timings.update(processing.stats.timings)
+            if building is not None:
+                result['comps'] = len(building.comparaments)
+                result['vents'] = len(building.wallvents)
+
+                for fmt in formats:
+                    t = time.perf_counter()
+                    out_path = os.path.join(out_dir, '{}.{}'.format(stem, fmt))
+                    with open(out_path, 'wb') as stream:
+                        FORMATS[fmt](stream, building)
+                    timings[fmt] = time.perf_counter() - t
+                    result['outputs'].append(out_path)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+'''
+Параллельный экспорт списка документов
+
+Результаты возвращаются в порядке следования файлов
+'''
+def export_files(svg_files:list, output_dir:str=None, formats:tuple=DEFAULT_FORMATS, jobs:int=None,
+                 use_cache:bool=True, level_jobs:int=1, profile:bool=False, streaming:bool=False,
+                 snap:int=None) -> list:
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if jobs == 1 or len(svg_files) <= 1:
+        return [export_file(path, output_dir, formats, use_cache, level_jobs, profile, streaming, snap)
+                for path in svg_files]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(export_file, path, output_dir, formats, use_cache, level_jobs, profile, streaming, snap)
+                   for path in svg_files]
+        return [future.result() for future in futures]
+
+def print_summary(results:list, wall_time:float, stream=sys.stdout) -> None:
+    failures = [r for r in results if r['error']]
+    for r in results:
+        if r['error']:
+            stream.write('FAIL  {}\n'.format(r['file']))
+            continue
+        timings = '  '.join('{}={:.3f}s'.format(k, v) for k, v in r['timings'].items())
+        cached = '  cached_levels={}'.format(r['cached_levels']) if 'cached_levels' in r else ''
+        stream.write('OK    {}  comps={} vents={}{}  {}\n'.format(r['file'], r['comps'], r['vents'], cached, timings))
+        for warning in r.get('warnings', ()):
+            stream.write('      warning: {}\n'.format(warning))
+
+    stream.write('---------------------------------\n')
+    stream.write('Files: {}  succeeded: {}  failed: {}  wall time: {:.3f}s\n'.format(
+                 len(results), len(results) - len(failures), len(failures), wall_time))
+    for r in failures:
+        stream.write('=================================\n')
+        stream.write('{}\n{}'.format(r['file'], r['error']))
+
+def main(argv:list=None) -> int:
+    pars = argparse.ArgumentParser(description='Batch export of SVG buildings to CFAST/Smokeview files')
+    pars.add_argument('paths', nargs='+', help='SVG or {} files, or directories with them'.format(MODEL_SUFFIX))
+    pars.add_argument('-o', '--output-dir', dest='output_dir', default=None,
+                      help='directory for generated files (default: next to each SVG)')
+    pars.add_argument('-f', '--formats', dest='formats', default=','.join(DEFAULT_FORMATS),
+                      help='comma separated list of output formats: {} (default: {})'.format(
+                           ', '.join(FORMATS), ','.join(DEFAULT_FORMATS)))
+    pars.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(),
+                      help='number of worker processes (default: number of CPUs)')
+    pars.add_argument('--level-jobs', dest='level_jobs', type=int, default=1,
+                      help='number of worker processes for the levels of one file (default: 1)')
+    pars.add_argument('--profile', action='store_true',
+                      help='save a cProfile dump <name>.prof next to the outputs of each file')
+    pars.add_argument('--stream', dest='streaming', action='store_true',
+                      help='process and write one level at a time to bound memory by the largest level '
+                           '(formats: {})'.format(', '.join(STREAM_FORMATS)))
+    pars.add_argument('--snap', dest='snap', type=int, default=None,
+                      help='snap tolerance in millimetres: closer rooms and doors are treated as touching '
+                           '(default: ${} or 0)'.format(SNAP_ENV))
+    pars.add_argument('--no-cache', dest='use_cache', action='store_false',
+                      help='do not read or update the per-level mapping cache in the user cache directory '
+                           '($CFAST_CACHE_DIR, $XDG_CACHE_HOME/cfast-inkex or ~/.cache/cfast-inkex)')
+    opt = pars.parse_args(argv)
+
+    formats = tuple(fmt.strip().lstrip('.') for fmt in opt.formats.split(',') if fmt.strip())
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown:
+        pars.error('unknown format: {}'.format(', '.join(unknown)))
+    if opt.streaming and any(fmt not in STREAM_FORMATS for fmt in formats):
+        pars.error('--stream supports only the formats: {}'.format(', '.join(STREAM_FORMATS)))
+
+    svg_files = collect_svg_files(opt.paths)
+    t = time.perf_counter()
+    results = export_files(svg_files, opt.output_dir, formats, opt.jobs, opt.use_cache, opt.level_jobs, opt.profile,
+                           opt.streaming, opt.snap)
+    print_summary(results, time.perf_counter() - t)
+    return 1 if any(r['error'] for r in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the export pipeline on synthetic buildings
+
+    python cfast_benchmark.py 1x100x150 4x400x600 10x1000x1500
+
+Each scenario is LEVELSxROOMSxDOORS (rooms and doors per level).
+"""
+
+import argparse
+import gzip
+import importlib
+import io
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+import inkex
+from export_cfast_geometry import CfastProcessing, CfastFile, numpy
+from export_smv_geometry import SmvFile
+
+DEFAULT_SCENARIOS = ('1x100x150', '4x400x600', '10x1000x1500')
+PHASES = ('parse', 'link', 'match', 'vents', 'write_in', 'write_smv')
+# Эталонные .in и .smv, полученные исходной версией расширения
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark')
+REFERENCE_MODULES = ('export_cfast_geometry', 'export_smv_geometry')
+
+ROOM_WIDTH = 100.0
+ROOM_DEPTH = 80.0
+DOOR_LENGTH = 20.0
+DOOR_THICKNESS = 6.0
+K_SCALE = 0.05
+
+SVG_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+           '<svg xmlns="http://www.w3.org/2000/svg" ' \
+           'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" ' \
+           'xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd" ' \
+           'xmlns:cfast="cfast" width="{width}" height="{height}" sodipodi:docname="{name}">\n'
+RECT = '<rect id="rect{id}" x="{x}" y="{y}" width="{w}" height="{h}" style="fill:none;stroke:#000000"/>\n'
+
+'''
+Генерация svg-документа здания
+
+Каждый этаж - сетка помещений, этажи нарисованы рядом друг с другом и связаны
+точками привязки (cfast:link_id). Двери выбираются случайно из проемов между
+соседними помещениями и проемов на внешних стенах
+'''
+def generate_building(levels:int, rooms:int, doors:int, seed:int=0, name:str='benchmark.svg') -> str:
+    rnd = random.Random(seed)
+    cols = max(1, int(math.ceil(math.sqrt(rooms))))
+    rows = int(math.ceil(rooms / cols))
+    level_width = cols * ROOM_WIDTH + 4 * ROOM_WIDTH
+    next_id = iter(range(1, 10**9))
+
+    parts = [SVG_HEAD.format(width=levels * level_width, height=rows * ROOM_DEPTH, name=name)]
+    for level in range(levels):
+        ox = level * level_width + 2 * ROOM_WIDTH
+        link = ' cfast:link_id="spot{},spot{}"'.format(level - 1, level) if level > 0 else ''
+        parts.append('<g inkscape:groupmode="layer" id="level{0}" inkscape:label="Level{1}" '
+                     'cfast:k_width="{2}" cfast:k_height="{2}"{3}>\n'.format(level, level + 1, K_SCALE, link))
+
+        parts.append('<g inkscape:groupmode="layer" id="rooms{}" inkscape:label="rooms">\n'.format(level))
+        cells = [(i, j) for j in range(rows) for i in range(cols)][:rooms]
+        for i, j in cells:
+            parts.append(RECT.format(id=next(next_id), x=ox + i * ROOM_WIDTH, y=j * ROOM_DEPTH, w=ROOM_WIDTH, h=ROOM_DEPTH))
+        parts.append('<circle id="spot{}" cx="{}" cy="{}" r="5"/>\n'.format(level, ox, rows * ROOM_DEPTH))
+        parts.append('</g>\n')
+
+        occupied = set(cells)
+        openings = []
+        for i, j in cells:
+            if (i + 1, j) in occupied:
+                openings.append((ox + (i + 1) * ROOM_WIDTH - DOOR_THICKNESS / 2, (j + 0.5) * ROOM_DEPTH - DOOR_LENGTH / 2,
+                                 DOOR_THICKNESS, DOOR_LENGTH))
+            if (i, j + 1) in occupied:
+                openings.append((ox + (i + 0.5) * ROOM_WIDTH - DOOR_LENGTH / 2, (j + 1) * ROOM_DEPTH - DOOR_THICKNESS / 2,
+                                 DOOR_LENGTH, DOOR_THICKNESS))
+            if i == 0:
+                openings.append((ox - DOOR_THICKNESS / 2, (j + 0.5) * ROOM_DEPTH - DOOR_LENGTH / 2,
+                                 DOOR_THICKNESS, DOOR_LENGTH))
+        chosen = sorted(rnd.sample(range(len(openings)), min(doors, len(openings))))
+
+        parts.append('<g inkscape:groupmode="layer" id="doors{}" inkscape:label="doors">\n'.format(level))
+        for k in chosen:
+            x, y, w, h = openings[k]
+            parts.append(RECT.format(id=next(next_id), x=x, y=y, w=w, h=h))
+        parts.append('</g>\n')
+        parts.append('</g>\n')
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+def golden_paths(scenario:str, seed:int) -> tuple:
+    stem = os.path.join(GOLDEN_DIR, '{}-seed{}'.format(scenario, seed))
+    return stem + '.in.gz', stem + '.smv.gz'
+
+'''
+Эталонный результат сценария или None, если эталона нет
+'''
+def load_golden(scenario:str, seed:int):
+    paths = golden_paths(scenario, seed)
+    if not all(os.path.isfile(path) for path in paths):
+        return None
+    result = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+            result.append(f.read())
+    return tuple(result)
+
+def save_golden(scenario:str, seed:int, golden:tuple) -> None:
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for path, content in zip(golden_paths(scenario, seed), golden):
+        # mtime=0: архив не меняется при повторной генерации того же эталона
+        with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            f.write(content.encode('utf-8'))
+
+'''
+Загрузка исходной версии расширения из каталога directory
+
+Модули импортируются под своими именами, чтобы export_smv_geometry исходной версии
+получил свой export_cfast_geometry, после чего текущие модули возвращаются на место
+'''
+def load_reference(directory:str) -> tuple:
+    saved = {name: sys.modules.pop(name, None) for name in REFERENCE_MODULES}
+    sys.path.insert(0, os.path.abspath(directory))
+    try:
+        return tuple(importlib.import_module(name) for name in REFERENCE_MODULES)
+    finally:
+        sys.path.pop(0)
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+'''
+Экспорт документа исходной версией расширения: все фигуры документа в порядке
+следования, как при выделении всего (select_all) в Inkscape
+'''
+def render_reference(reference:tuple, svg_path:str, name:str) -> tuple:
+    cfast, smv = reference
+    elements = load_document(svg_path).descendants().filter(cfast.ShapeElement).values()
+    comps, w_vents = cfast.CfastProcessing().mapping(elements)
+    ink_self = types.SimpleNamespace(svg=types.SimpleNamespace(name=name))
+    return cfast.CfastFile(comps, w_vents).to_string(), smv.SmvFile(comps, w_vents, ink_self).to_string()
+
+def load_document(svg_path:str):
+    return inkex.load_svg(svg_path).getroot()
+
+def render(comps:list, w_vents:list, name:str) -> tuple:
+    return CfastFile(comps, w_vents).to_string(), SmvFile(comps, w_vents, name=name).to_string()
+
+'''
+Замер этапов экспорта одного документа
+'''
+def run_phases(svg_path:str, processing:CfastProcessing) -> tuple:
+    timings = {}
+
+    t = time.perf_counter()
+    levels = processing.collect(load_document(svg_path))
+    timings['parse'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    processing.link_levels(levels)
+    timings['link'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    comparaments = {}
+    wallvents = {}
+    for level_comps, level_vents in processing.match_levels(levels):
+        comparaments.update(level_comps)
+        wallvents.update(level_vents)
+    comps, w_vents = processing.sort_result(comparaments, wallvents)
+    timings['vents'] = processing.stats.timings.get('vents', 0.0)
+    timings['match'] = time.perf_counter() - t - timings['vents']
+
+    name = os.path.basename(svg_path)
+    t = time.perf_counter()
+    CfastFile(comps, w_vents).write_to(io.BytesIO())
+    timings['write_in'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    SmvFile(comps, w_vents, name=name).write_to(io.BytesIO())
+    timings['write_smv'] = time.perf_counter() - t
+
+    return timings, comps, w_vents
+
+def parse_scenario(scenario:str) -> tuple:
+    levels, rooms, doors = (int(v) for v in scenario.lower().split('x'))
+    return levels, rooms, doors
+
+def main(argv:list=None) -> int:
+    pars = argparse.ArgumentParser(description='Benchmark of the CFAST export pipeline on synthetic buildings')
+    pars.add_argument('scenarios', nargs='*', default=list(DEFAULT_SCENARIOS),
+                      help='LEVELSxROOMSxDOORS, rooms and doors per level (default: {})'.format(' '.join(DEFAULT_SCENARIOS)))
+    pars.add_argument('--repeat', type=int, default=1, help='runs per scenario, the best time is reported')
+    pars.add_argument('--seed', type=int, default=0)
+    pars.add_argument('--check-limit', dest='check_limit', type=int, default=2000,
+                      help='compare with the golden files when the building has at most this many rooms '
+                           '(0 disables the check)')
+    pars.add_argument('--reference', dest='reference', default=None,
+                      help='directory with the baseline export_cfast_geometry.py and export_smv_geometry.py; '
+                           'regenerate the golden files from it')
+    opt = pars.parse_args(argv)
+
+    reference = load_reference(opt.reference) if opt.reference else None
+    engines = [('python', False)] + ([('numpy', True)] if numpy is not None else [])
+    header = '{:<16} {:<7}'.format('scenario', 'engine') + ''.join('{:>11}'.format(p) for p in PHASES) + \
+             '{:>11}{:>12}  {}'.format('total', 'us/room', 'check')
+    print(header)
+    print('-' * len(header))
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in opt.scenarios:
+            levels, rooms, doors = parse_scenario(scenario)
+            name = 'benchmark_{}.svg'.format(scenario)
+            svg_path = os.path.join(tmp, name)
+            with open(svg_path, 'w', encoding='utf-8') as f:
+                f.write(generate_building(levels, rooms, doors, opt.seed, name))
+
+            golden = None
+            if 0 < levels * rooms <= opt.check_limit:
+                if reference is not None:
+                    save_golden(scenario, opt.seed, render_reference(reference, svg_path, name))
+                golden = load_golden(scenario, opt.seed)
+
+            for engine, use_numpy in engines:
+                best = None
+                for _ in range(max(1, opt.repeat)):
+                    timings, comps, w_vents = run_phases(svg_path, CfastProcessing(use_numpy=use_numpy))
+                    if best is None or sum(timings.values()) < sum(best.values()):
+                        best = timings
+
+                check = 'skipped'
+                if golden is not None:
+                    check = 'ok' if render(comps, w_vents, name) == golden else 'MISMATCH'
+                    failed = failed or check != 'ok'
+
+                total = sum(best.values())
+                print('{:<16} {:<7}'.format(scenario, engine) +
+                      ''.join('{:>11.4f}'.format(best[p]) for p in PHASES) +
+                      '{:>11.4f}{:>12.1f}  {}'.format(total, total / max(1, levels * rooms) * 1e6, check))
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
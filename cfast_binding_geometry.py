@@ -16,20 +16,64 @@
 # limitations under the License.
 
 import inkex
+from export_cfast_geometry import level_layers
+
+SELECTED = 'selected'
+ALL_LEVELS = 'all'
+# Имя (метка или id) прямоугольника, по которому задается масштаб всех этажей
+REFERENCE = 'scale'
+
+'''
+Прямоугольник с именем name: метка совпадает с name или id имеет вид name, name-<N>, name_<N>
+'''
+def is_reference(elem, name:str) -> bool:
+    if (elem.label or '').lower() == name.lower():
+        return True
+    elem_id = elem.get_id() or ''
+    return elem_id == name or (elem_id.startswith(name) and elem_id[len(name):len(name) + 1] in ('-', '_'))
 
 class CfastBindingGeom(inkex.EffectExtension):
     def add_arguments(self, pars):
         pars.add_argument("--tab")
         pars.add_argument("--width",    type=float,          dest="width")
         pars.add_argument("--depth",    type=float,          dest="depth")
+        pars.add_argument("--mode",     type=str,            dest="mode", default=SELECTED)
+        pars.add_argument("--reference", type=str,           dest="reference", default=REFERENCE)
 
     def effect(self):
         opt = self.options
+        if opt.mode == ALL_LEVELS:
+            self.calibrate_levels(opt.reference, opt.width, opt.depth)
+            return
 
         selected_elem = list(self.svg.selection.filter(inkex.Rectangle).values())[0]
         level_parent = selected_elem.getparent().getparent()
         level_parent.set("cfast:k_width", opt.width/selected_elem.width)
         level_parent.set("cfast:k_height", opt.depth/selected_elem.height)
 
+    '''
+    Масштаб всех этажей за один обход документа
+
+    На каждом этаже ищется первый прямоугольник с именем reference, его ширина
+    и глубина на чертеже соответствуют width и depth в метрах. Этажи без такого
+    прямоугольника не изменяются и перечисляются в сообщении
+    '''
+    def calibrate_levels(self, reference:str, width:float, depth:float):
+        calibrated = 0
+        missing = []
+        for layer in level_layers(self.svg):
+            rect = next((elem for elem in layer.iterdescendants()
+                         if isinstance(elem, inkex.Rectangle) and is_reference(elem, reference)), None)
+            if rect is None or not rect.width or not rect.height:
+                missing.append(layer.label)
+                continue
+            layer.set("cfast:k_width", width/rect.width)
+            layer.set("cfast:k_height", depth/rect.height)
+            calibrated += 1
+
+        self.msg('Масштаб задан для этажей: {}'.format(calibrated))
+        if missing:
+            self.msg('Не найден прямоугольник {} на этажах: {}'.format(reference, ', '.join(missing)))
+
 if __name__ == '__main__':
     CfastBindingGeom().run()
@@ -15,11 +15,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
 import inkex
 from inkex import ShapeElement
+from export_cfast_geometry import level_layers
 
 LINK = 'link'
 UNLINK = 'unlink'
+AUTO = 'auto'
+SPOT_SUFFIX = re.compile(r'[-_]\d+$')
+
+'''
+Имя точки привязки: метка окружности или id без номера этажа в конце (spot-1, spot-2 -> spot)
+Точки соседних этажей с одинаковым именем считаются одной точкой привязки
+'''
+def spot_name(elem) -> str:
+    return elem.label or SPOT_SUFFIX.sub('', elem.get_id())
 '''
 Приявязка уровней
 Первый выделенный - базовый
@@ -34,6 +46,9 @@ class CfastLinkingLevels(inkex.EffectExtension):
 
     def effect(self):
         opt = self.options
+        if opt.linking == AUTO:
+            self.link_levels()
+            return
 
         selected_elems = list(self.svg.selection.filter(ShapeElement).values())
         selected_elem_1 = selected_elems[0]
@@ -48,5 +63,33 @@ class CfastLinkingLevels(inkex.EffectExtension):
             elif opt.linking == UNLINK:
                 level_parent.pop(attr_name)
 
+    '''
+    Привязка каждого этажа к предыдущему за один обход документа
+
+    Для каждой пары соседних этажей выбирается первая точка верхнего этажа,
+    имя которой есть среди точек нижнего этажа. Этажи без общей точки не изменяются
+    '''
+    def link_levels(self):
+        linked = 0
+        missing = []
+        lower = None
+        for layer in level_layers(self.svg):
+            spots = {}
+            for elem in layer.iterdescendants():
+                if isinstance(elem, (inkex.Circle, inkex.Ellipse)):
+                    spots.setdefault(spot_name(elem), elem)
+            if lower is not None:
+                name = next((name for name in spots if name in lower), None)
+                if name is None:
+                    missing.append(layer.label)
+                else:
+                    layer.set('cfast:link_id', '{},{}'.format(lower[name].get_id(), spots[name].get_id()))
+                    linked += 1
+            lower = spots
+
+        self.msg('Привязано этажей: {}'.format(linked))
+        if missing:
+            self.msg('Нет общей точки привязки с нижним этажом: {}'.format(', '.join(missing)))
+
 if __name__ == '__main__':
     CfastLinkingLevels().run()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Thin launcher of the export extensions
+
+Inkscape starts this script with --script=<extension script name>. If the export
+daemon (cfast_daemon.py) is running, the export is done by the daemon, otherwise
+the extension script is run in this process as before. Only the standard library
+is imported here, so a served export does not pay for importing inkex and the geometry core
+"""
+
+import time
+START = time.perf_counter()
+
+import json
+import os
+import runpy
+import socket
+import stat
+import sys
+import tempfile
+
+# Переменная окружения с путем к сокету демона
+SOCKET_ENV = 'CFAST_DAEMON_SOCKET'
+# Переменные окружения, которые передаются демону вместе с запросом
+FORWARD_ENV = ('CFAST_', 'DOCUMENT_PATH')
+# Расширения, которые может выполнить демон: скрипт -> (модуль, класс расширения)
+EXTENSIONS = {
+    'export_cfast_geometry': ('export_cfast_geometry', 'ExportCfastGeometry'),
+    'export_smv_geometry': ('export_smv_geometry', 'ExportCfastGeometry'),
+    'export_cfast_bundle': ('export_cfast_bundle', 'ExportCfastBundle'),
+    'export_cfast_shards': ('export_cfast_shards', 'ExportCfastShards'),
+    'export_cfast_model': ('export_cfast_model', 'ExportCfastModel'),
+}
+
+'''
+Путь к сокету демона: CFAST_DAEMON_SOCKET, иначе директория XDG_RUNTIME_DIR пользователя,
+иначе собственная директория пользователя с правами 0700 во временной директории
+'''
+def socket_path() -> str:
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'cfast-daemon.sock')
+    return os.path.join(tempfile.gettempdir(), 'cfast-daemon-{}'.format(getattr(os, 'getuid', lambda: 0)()),
+                        'daemon.sock')
+
+'''
+Сокет и его директория принадлежат текущему пользователю и недоступны остальным
+
+Иначе сокет мог создать другой пользователь, чтобы получать документы и подменять результат экспорта
+'''
+def is_private(path:str) -> bool:
+    if not hasattr(os, 'getuid'):
+        return False
+    try:
+        st = os.lstat(path)
+        dir_st = os.stat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    uid = os.getuid()
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == uid and not st.st_mode & 0o077 and \
+           dir_st.st_uid == uid and not dir_st.st_mode & 0o022
+
+'''
+Разбор аргументов запуска: имя скрипта расширения и остальные аргументы для inkex
+'''
+def split_args(argv:list) -> tuple:
+    script = None
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg.startswith('--script='):
+            script = arg.split('=', 1)[1]
+        elif arg == '--script':
+            script = next(args, None)
+        else:
+            rest.append(arg)
+    return script, rest
+
+def read_exactly(stream, size:int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ConnectionError('daemon closed the connection')
+    return data
+
+'''
+Запрос к демону: заголовок ответа и выходные данные
+
+Возвращает None, если демон не запущен, не смог выполнить запрос или сокет
+не принадлежит пользователю, тогда экспорт выполняется в этом процессе
+'''
+def request(message:dict, timeout:float=None):
+    path = socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not is_private(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            with sock.makefile('rwb') as stream:
+                stream.write(json.dumps(message).encode('utf-8') + b'\n')
+                stream.flush()
+                header = json.loads(stream.readline())
+                output = read_exactly(stream, header.get('size', 0))
+    except (OSError, ValueError):
+        return None
+    return header, output
+
+def served(script:str, argv:list):
+    env = {key: value for key, value in os.environ.items() if key.startswith(FORWARD_ENV)}
+    return request({'script': script, 'argv': argv, 'cwd': os.getcwd(), 'env': env})
+
+'''
+Запуск скрипта расширения в этом процессе, как если бы его вызвал Inkscape
+'''
+def run_in_process(script:str, argv:list) -> None:
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script + '.py')
+    sys.argv = [path] + argv
+    runpy.run_path(path, run_name='__main__')
+
+def main(argv:list=None) -> int:
+    script, rest = split_args(sys.argv[1:] if argv is None else argv)
+    if script not in EXTENSIONS:
+        sys.stderr.write('Неизвестное расширение: {}\n'.format(script))
+        return 1
+
+    response = served(script, rest)
+    if response is None:
+        run_in_process(script, rest)
+        sys.stderr.write('Демон CFAST не запущен, экспорт в процессе: {:.3f} с\n'.format(time.perf_counter() - START))
+        return 0
+
+    header, output = response
+    if output:
+        sys.stdout.buffer.write(output)
+        sys.stdout.flush()
+    sys.stderr.write(header.get('messages', ''))
+    if header.get('status'):
+        return header['status']
+    sys.stderr.write('Демон CFAST: {}, экспорт {:.3f} с, всего {:.3f} с\n'.format(
+                     'документ из кэша' if header.get('cached') else 'документ разобран за {:.3f} с'.format(header.get('parse', 0.0)),
+                     header.get('time', 0.0), time.perf_counter() - START))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local export daemon: keeps inkex and the geometry core loaded and the last parsed
+documents in memory, and runs the export extensions for cfast_client.py over a Unix socket
+
+    python cfast_daemon.py             # start in the foreground
+    python cfast_daemon.py --stop      # stop a running daemon
+"""
+
+import argparse
+import hashlib
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, redirect_stderr
+
+from cfast_client import EXTENSIONS, FORWARD_ENV, SOCKET_ENV, socket_path, request, is_private
+from cfast_mapping_cache import CfastMappingCache
+
+# Количество разобранных документов, хранимых в памяти
+MAX_DOCUMENTS = 8
+# Количество этажей в кэше сопоставления демона
+MAX_CACHED_LEVELS = 4096
+
+class CfastDocuments:
+    '''
+    Последние разобранные документы по хэшу содержимого файла
+
+    Inkscape передает расширению сохраненную копию документа, поэтому
+    неизмененный документ узнается по содержимому, а не по имени файла
+    '''
+    def __init__(self, max_documents:int=MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self.entries = OrderedDict()
+
+    def get(self, key:str):
+        document = self.entries.get(key)
+        if document is not None:
+            self.entries.move_to_end(key)
+        return document
+
+    def put(self, key:str, document) -> None:
+        self.entries[key] = document
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_documents:
+            self.entries.popitem(last=False)
+
+'''
+Класс расширения, который берет разобранный документ и результаты сопоставления этажей из памяти демона
+
+Экспорт не изменяет документ, поэтому один разобранный документ используется
+во всех экспортах, пока его содержимое не изменится. Кэш этажей общий для всех документов:
+ключ записи - хэш содержимого этажа
+'''
+def served_extension(cls, documents:CfastDocuments, mapping_cache:CfastMappingCache):
+    class ServedExtension(cls):
+        cached = False
+        parse_time = 0.0
+
+        def load(self, stream):
+            t = time.perf_counter()
+            data = stream.read()
+            key = hashlib.sha1(data).hexdigest()
+            document = documents.get(key)
+            if document is None:
+                document = super().load(io.BytesIO(data))
+                documents.put(key, document)
+            else:
+                self.svg = document.getroot()
+                self.cached = True
+            self.parse_time = time.perf_counter() - t
+            return document
+
+    ServedExtension.mapping_cache = mapping_cache
+    ServedExtension.__name__ = cls.__name__
+    return ServedExtension
+
+'''
+Временная замена рабочей директории и переменных окружения на значения клиента
+
+Клиент передает все свои переменные CFAST_* (FORWARD_ENV), поэтому переменные демона
+с этими префиксами, которых нет у клиента, на время запроса удаляются: экспорт через
+демон выполняется с тем же окружением, что и в процессе клиента
+'''
+@contextmanager
+def client_context(cwd:str, env:dict):
+    old_cwd = os.getcwd()
+    keys = set(env) | {key for key in os.environ if key.startswith(FORWARD_ENV)}
+    old_env = {key: os.environ.get(key) for key in keys}
+    os.chdir(cwd)
+    for key in keys - set(env):
+        os.environ.pop(key, None)
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+        for key, value in old_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+class CfastDaemon(socketserver.UnixStreamServer):
+    '''
+    Сервер экспорта: запросы выполняются по одному, так как каждый запрос
+    временно меняет рабочую директорию, окружение и поток сообщений процесса
+    '''
+    def __init__(self, path:str):
+        self.documents = CfastDocuments()
+        self.mapping_cache = CfastMappingCache(None, max_entries=MAX_CACHED_LEVELS)
+        self.extensions = {}
+        for script, (module, name) in EXTENSIONS.items():
+            self.extensions[script] = served_extension(getattr(importlib.import_module(module), name),
+                                                       self.documents, self.mapping_cache)
+        self.running = True
+        super().__init__(path, CfastRequestHandler)
+
+    def export(self, script:str, argv:list, cwd:str, env:dict) -> tuple:
+        ext = self.extensions[script]()
+        output = io.BytesIO()
+        messages = io.StringIO()
+        status = 0
+        self.mapping_cache.hits = self.mapping_cache.misses = 0
+        t = time.perf_counter()
+        with client_context(cwd, env), redirect_stderr(messages):
+            try:
+                ext.run(argv, output=output)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+        header = {'status': status, 'messages': messages.getvalue(), 'cached': ext.cached,
+                  'parse': ext.parse_time, 'time': time.perf_counter() - t}
+        return header, output.getvalue()
+
+class CfastRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        command = message.get('command')
+        if command in ('ping', 'stop'):
+            header, output = {'status': 0, 'documents': len(self.server.documents.entries)}, b''
+            self.server.running = command != 'stop'
+        elif message.get('script') in self.server.extensions:
+            header, output = self.server.export(message['script'], message.get('argv', []),
+                                                message.get('cwd', os.getcwd()), message.get('env', {}))
+        else:
+            header, output = {'status': 1, 'messages': 'Unknown request\n'}, b''
+        header['size'] = len(output)
+        self.wfile.write(json.dumps(header).encode('utf-8') + b'\n')
+        self.wfile.write(output)
+
+'''
+Запуск демона: сокет и его директория доступны только текущему пользователю
+'''
+def serve(path:str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    dir_st = os.stat(directory)
+    if dir_st.st_uid != os.getuid() or dir_st.st_mode & 0o022:
+        raise SystemExit('socket directory {} must be owned by the current user and not writable by others'
+                         .format(directory))
+    if os.path.lexists(path):
+        if not is_private(path):
+            raise SystemExit('{} is not a socket owned by the current user'.format(path))
+        if request({'command': 'ping'}, timeout=1.0) is not None:
+            raise SystemExit('daemon is already running on {}'.format(path))
+        os.unlink(path)
+    old_umask = os.umask(0o077)
+    try:
+        server = CfastDaemon(path)
+    finally:
+        os.umask(old_umask)
+    print('CFAST export daemon listening on {}'.format(path), flush=True)
+    try:
+        while server.running:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def main(argv:list=None) -> int:
+    pars = argparse.ArgumentParser(description='Local daemon that keeps the CFAST exporters loaded '
+                                               'and serves exports started through cfast_client.py')
+    pars.add_argument('--socket', default=None, help='Unix socket path (default: {})'.format(socket_path()))
+    pars.add_argument('--stop', action='store_true', help='stop a running daemon')
+    pars.add_argument('--status', action='store_true', help='check whether the daemon is running')
+    opt = pars.parse_args(argv)
+    if opt.socket:
+        os.environ[SOCKET_ENV] = opt.socket
+    path = socket_path()
+
+    if opt.stop or opt.status:
+        response = request({'command': 'stop' if opt.stop else 'ping'}, timeout=5.0)
+        if response is None:
+            print('daemon is not running')
+            return 1
+        print('daemon stopped' if opt.stop else 'daemon is running, documents in memory: {}'.format(
+              response[0].get('documents', 0)))
+        return 0
+    if not hasattr(socket, 'AF_UNIX'):
+        print('Unix sockets are not supported on this platform', file=sys.stderr)
+        return 1
+    serve(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fixed-point geometry kernel: coordinates are quantized to integer millimetres
+
+Containment, overlap and the face and offset of wall vents are computed on integer
+boxes, so the result does not depend on how the scale and the level offsets were
+rounded. Shapes closer than the snap tolerance are treated as touching
+"""
+
+import os
+
+# Единиц координат в метре: координаты хранятся в целых миллиметрах
+UNITS = 1000
+# Переменная окружения с допуском привязки в миллиметрах: CFAST_SNAP=5
+SNAP_ENV = 'CFAST_SNAP'
+# Допуск по умолчанию: касанием считается только совпадение координат
+DEFAULT_SNAP = 0
+# Расхождение координат из-за независимого округления начала и размера прямоугольника
+ROUNDING = 1
+
+def to_units(value:float) -> int:
+    return int(round(value * UNITS))
+
+def to_metres(value:int) -> float:
+    return value / UNITS
+
+def snap_from_env() -> int:
+    try:
+        return max(0, int(os.environ.get(SNAP_ENV, DEFAULT_SNAP)))
+    except ValueError:
+        return DEFAULT_SNAP
+
+'''
+Габарит прямоугольника (x0, y0, x1, y1) в миллиметрах
+
+Ширина и высота квантуются отдельно от начала, поэтому одинаковые по размеру
+прямоугольники остаются одинаковыми после смещения этажа
+'''
+def box(rect) -> tuple:
+    return box_of(rect.x0, rect.y0, rect.width, rect.height)
+
+def box_of(x0:float, y0:float, width:float, height:float) -> tuple:
+    x0 = to_units(x0)
+    y0 = to_units(y0)
+    return x0, y0, x0 + to_units(width), y0 + to_units(height)
+
+'''
+Углы габарита в порядке CfastRectangle.get_points
+'''
+def corners(b:tuple) -> tuple:
+    x0, y0, x1, y1 = b
+    return (x0, y0), (x1, y0), (x1, y1), (x0, y1)
+
+'''
+Точка внутри габарита или на его границе с учетом допуска
+'''
+def contains(b:tuple, x:int, y:int, snap:int=DEFAULT_SNAP) -> bool:
+    return b[0] - snap <= x <= b[2] + snap and b[1] - snap <= y <= b[3] + snap
+
+'''
+Сторона габарита comp, которой касается габарит двери vent: (номер стороны, ширина, смещение)
+
+Стороны перебираются в порядке CfastRectangle.get_segments: по первой паре касающихся
+сторон сторона двери задает ширину, а сторона помещения - номер грани и угол,
+от которого отсчитывается смещение. Стороны с зазором не больше snap касаются.
+Для вырожденных габаритов и дверей, не касающихся сторон помещения, возвращает None
+'''
+def wallvent_side(vent:tuple, comp:tuple, snap:int=DEFAULT_SNAP):
+    dx0, dy0, dx1, dy1 = vent
+    cx0, cy0, cx1, cy1 = comp
+    if dx0 >= dx1 or dy0 >= dy1 or cx0 >= cx1 or cy0 >= cy1:
+        return None
+
+    # Габариты сторон (x_min, x_max, y_min, y_max) в порядке get_segments
+    vent_sides = ((dx0, dx1, dy0, dy0), (dx1, dx1, dy0, dy1), (dx0, dx1, dy1, dy1), (dx0, dx0, dy0, dy1))
+    comp_sides = ((cx0, cx1, cy0, cy0), (cx1, cx1, cy0, cy1), (cx0, cx1, cy1, cy1), (cx0, cx0, cy0, cy1))
+    for i, (ax0, ax1, ay0, ay1) in enumerate(vent_sides):
+        for j, (bx0, bx1, by0, by1) in enumerate(comp_sides):
+            if max(ax0, bx0) <= min(ax1, bx1) + snap and max(ay0, by0) <= min(ay1, by1) + snap:
+                # Горизонтальная сторона двери - дверь в вертикальной стене, ширина по y
+                width = dy1 - dy0 if i % 2 == 0 else dx1 - dx0
+                offset = (abs(cx0 - dx0), abs(cy0 - dy0), abs(cx1 - dx1), abs(cy1 - dy1))[j]
+                return j, width, offset
+    return None
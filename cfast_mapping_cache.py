@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent per-level cache of mapping results stored in the user cache directory
+"""
+
+import hashlib
+import json
+import os
+
+from export_cfast_geometry import CfastComparament, CfastWallVent, CfastPoint, CfastLevel
+
+# Переменная окружения для отключения кэша: CFAST_CACHE=0
+CACHE_ENV = 'CFAST_CACHE'
+# Переменная окружения с директорией файлов кэша
+CACHE_DIR_ENV = 'CFAST_CACHE_DIR'
+
+'''
+Директория файлов кэша текущего пользователя: CFAST_CACHE_DIR,
+иначе стандартная директория кэша ОС (XDG_CACHE_HOME, LOCALAPPDATA или ~/.cache)
+'''
+def cache_dir() -> str:
+    path = os.environ.get(CACHE_DIR_ENV)
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or \
+           os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'cfast-inkex')
+
+class CfastMappingCache:
+    '''
+    Кэш результатов сопоставления по этажам
+
+    Ключ записи - хэш содержимого этажа: высота, масштаб, привязка, итоговое смещение,
+    координаты всех прямоугольников помещений и дверей и допуск касания snap. Если этаж не изменился,
+    его помещения и проемы восстанавливаются из кэша без повторного сопоставления.
+
+    Размер кэша ограничен max_entries записями, записи, которые не использовались
+    последние max_age экспортов, удаляются при сохранении.
+    Кэш без пути к файлу хранится только в памяти (используется демоном экспорта).
+    Ошибка записи файла не прерывает экспорт: save возвращает False, текст ошибки - в error.
+    '''
+    VERSION = 2
+    SUFFIX = '.cfastcache'
+    MAX_ENTRIES = 512
+    MAX_AGE = 20
+
+    def __init__(self, path:str, max_entries:int=MAX_ENTRIES, max_age:int=MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = {}
+        self.run = 0
+        self.hits = 0
+        self.misses = 0
+        self.error = None
+        self.load()
+
+    '''
+    Кэш документа в директории кэша пользователя, а не рядом с документом.
+    Имя файла включает хэш полного пути, поэтому одноименные документы не смешиваются
+    '''
+    @classmethod
+    def for_document(cls, svg_path:str, **kwargs):
+        path = os.path.abspath(svg_path)
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return cls(os.path.join(cache_dir(), '{}-{}{}'.format(stem, digest, cls.SUFFIX)), **kwargs)
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return
+        self.entries = data.get('levels', {})
+        self.run = data.get('run', 0)
+
+    '''
+    Сохранение кэша с вытеснением устаревших и давно не использованных записей
+    Запись выполняется через временный файл, чтобы прерванный экспорт не испортил кэш.
+    Возвращает False, если файл записать не удалось
+    '''
+    def save(self) -> bool:
+        self.run += 1
+        entries = [(key, entry) for key, entry in self.entries.items()
+                   if self.run - entry['used'] <= self.max_age]
+        entries.sort(key=lambda item: item[1]['used'], reverse=True)
+        self.entries = dict(entries[:self.max_entries])
+        if self.path is None:
+            return True
+
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'run': self.run, 'levels': self.entries}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.error = str(e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    '''
+    Хэш содержимого этажа
+    '''
+    @classmethod
+    def level_key(cls, level:CfastLevel, snap:int=0) -> str:
+        h = hashlib.sha1()
+        h.update(repr((cls.VERSION, level.z, level.scale.k_width, level.scale.k_height,
+                       level.link, level.offset, snap)).encode('utf-8'))
+        for role, rects in (('room', level.comps_raw), ('door', level.wallvents_raw)):
+            for rect_id, rect in rects.items():
+                h.update(repr((role, rect_id, rect.x0, rect.y0, rect.width, rect.height)).encode('utf-8'))
+        return h.hexdigest()
+
+    '''
+    Помещения и проемы этажа из кэша или None, если этаж изменился
+    '''
+    def lookup(self, level:CfastLevel, snap:int=0):
+        entry = self.entries.get(self.level_key(level, snap))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['used'] = self.run + 1
+
+        comparaments = {}
+        for c in entry['comps']:
+            comparaments[c['id']] = CfastComparament(c['id'], c['depth'], c['width'], c['height'], CfastPoint(*c['origin']))
+        wallvents = {}
+        for v in entry['vents']:
+            wallvent = CfastWallVent(v['id'], v['comp_ids'], v['offset'], v['width'], v['top'], v['bottom'])
+            wallvent.face = v['face']
+            wallvents[v['id']] = wallvent
+        return comparaments, wallvents
+
+    def store(self, level:CfastLevel, comparaments:dict, wallvents:dict, snap:int=0) -> None:
+        self.entries[self.level_key(level, snap)] = {
+            'used': self.run + 1,
+            'comps': [{'id': c.id, 'depth': c.depth, 'width': c.width, 'height': c.height, 'origin': list(c.origin)}
+                      for c in comparaments.values()],
+            'vents': [{'id': v.id, 'comp_ids': list(v.comp_ids), 'offset': v.offset, 'width': v.width,
+                       'top': v.top, 'bottom': v.bottom, 'face': v.face}
+                      for v in wallvents.values()],
+        }
+
+'''
+Кэш для документа или None, если путь к документу неизвестен или кэш отключен
+'''
+def open_cache(svg_path:str):
+    if not svg_path or os.environ.get(CACHE_ENV, '1') == '0':
+        return None
+    return CfastMappingCache.for_document(svg_path)
+
+'''
+Кэш для документа, открытого в расширении Inkscape
+
+Расширение, запущенное демоном экспорта, использует общий кэш в памяти демона
+'''
+def extension_cache(ext):
+    if os.environ.get(CACHE_ENV, '1') == '0':
+        return None
+    if getattr(ext, 'mapping_cache', None) is not None:
+        return ext.mapping_cache
+    document_path = getattr(ext, 'document_path', None)
+    return open_cache(document_path() if document_path is not None else None)
+
+'''
+Сохранение кэша расширения: ошибка записи выводится предупреждением через warn (ext.msg)
+'''
+def save_cache(cache, warn) -> None:
+    if cache is not None and not cache.save():
+        warn('Кэш не сохранен: {}'.format(cache.error))
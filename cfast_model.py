@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact binary file of the mapped building model (.cfastmodel)
+
+The file stores the result of mapping, so CFAST and Smokeview files can be
+written again without parsing the SVG document.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from export_cfast_geometry import CfastBuilding, CfastComparament, CfastWallVent, CfastCeilingVent, CfastPoint
+
+MODEL_SUFFIX = '.cfastmodel'
+MAGIC = b'CFASTMDL'
+VERSION = 2
+# Версии, которые читаются: в версии 1 нет секции проемов в перекрытиях
+VERSIONS = (1, 2)
+
+# magic, версия, количество: строк, этажей, помещений, проемов, ссылок проемов на помещения
+HEADER = struct.Struct('<8sIIIIII')
+
+LEVEL_COLUMNS = ('z', 'k_width', 'k_height', 'dx', 'dy')
+COMP_COLUMNS = ('depth', 'width', 'height', 'x', 'y', 'z')
+VENT_COLUMNS = ('offset', 'width', 'top', 'bottom')
+CEILVENT_COLUMNS = ('area', 'x', 'y')
+
+NO_STRING = -1
+
+class CfastModelWriter:
+    '''
+    Формирование содержимого файла модели
+
+    После заголовка идут секции одна за другой, каждая выровнена на 8 байт:
+    таблица строк (смещения и текст UTF-8), затем по колонкам этажи, помещения, проемы
+    и проемы в перекрытиях (количество, затем колонки). Числа хранятся в порядке байтов little-endian, поэтому колонки читаются
+    из отображенного в память файла без разбора
+    '''
+    def __init__(self):
+        self.strings = {}
+        self.sections = []
+
+    def string(self, value:str) -> int:
+        if value is None:
+            return NO_STRING
+        return self.strings.setdefault(value, len(self.strings))
+
+    def column(self, typecode:str, values) -> None:
+        data = array(typecode, values)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        self.sections.append(data.tobytes())
+
+    def to_bytes(self, building:CfastBuilding) -> bytes:
+        self.string(building.name)
+
+        levels = building.levels
+        self.column('I', [self.string(level[0]) for level in levels])
+        for i in range(len(LEVEL_COLUMNS)):
+            self.column('d', [level[i + 1] for level in levels])
+
+        comps = building.comparaments
+        self.column('I', [self.string(comp.id) for comp in comps])
+        self.column('d', [comp.depth for comp in comps])
+        self.column('d', [comp.width for comp in comps])
+        self.column('d', [comp.height for comp in comps])
+        for i in range(3):
+            self.column('d', [comp.origin[i] for comp in comps])
+
+        vents = building.wallvents
+        starts = [0]
+        refs = []
+        for vent in vents:
+            refs.extend(self.string(comp_id) for comp_id in vent.comp_ids)
+            starts.append(len(refs))
+        self.column('I', [self.string(vent.id) for vent in vents])
+        self.column('I', [self.string(vent.type) for vent in vents])
+        self.column('i', [self.string(vent.face) for vent in vents])
+        self.column('I', starts)
+        self.column('I', refs)
+        for name in VENT_COLUMNS:
+            self.column('d', [getattr(vent, name) for vent in vents])
+
+        ceilvents = building.ceilvents
+        self.column('I', [len(ceilvents)])
+        self.column('I', [self.string(ceilvent.id) for ceilvent in ceilvents])
+        self.column('i', [self.string(ceilvent.comp_ids[0]) for ceilvent in ceilvents])
+        self.column('i', [self.string(ceilvent.comp_ids[1]) for ceilvent in ceilvents])
+        self.column('d', [ceilvent.area for ceilvent in ceilvents])
+        for i in range(2):
+            self.column('d', [ceilvent.offsets[i] for ceilvent in ceilvents])
+
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = [0]
+        for s in encoded:
+            offsets.append(offsets[-1] + len(s))
+        # Таблица строк заполняется при записи колонок, но в файле идет перед ними
+        body, self.sections = self.sections, []
+        self.column('I', offsets)
+        self.sections.append(b''.join(encoded))
+        self.sections.extend(body)
+
+        parts = [HEADER.pack(MAGIC, VERSION, len(encoded), len(levels), len(comps), len(vents), len(refs))]
+        for section in self.sections:
+            parts.append(section)
+            parts.append(b'\0' * (-len(section) % 8))
+        return b''.join(parts)
+
+class CfastModelReader:
+    '''
+    Чтение колонок файла модели из буфера (bytes или отображенного в память файла)
+    '''
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.pos = HEADER.size
+
+    def column(self, typecode:str, count:int) -> list:
+        size = array(typecode).itemsize * count
+        data = self.view[self.pos:self.pos + size]
+        if len(data) != size:
+            raise ValueError('truncated CFAST model file')
+        self.pos += size + (-size % 8)
+        if sys.byteorder == 'big':
+            values = array(typecode)
+            values.frombytes(data)
+            values.byteswap()
+            return values.tolist()
+        return data.cast(typecode).tolist()
+
+    def blob(self, size:int) -> bytes:
+        data = self.view[self.pos:self.pos + size].tobytes()
+        self.pos += size + (-size % 8)
+        return data
+
+    def building(self) -> CfastBuilding:
+        if len(self.view) < HEADER.size:
+            raise ValueError('not a CFAST model file')
+        magic, version, n_strings, n_levels, n_comps, n_vents, n_refs = HEADER.unpack_from(self.view)
+        if magic != MAGIC:
+            raise ValueError('not a CFAST model file')
+        if version not in VERSIONS:
+            raise ValueError('unsupported CFAST model version {}'.format(version))
+
+        offsets = self.column('I', n_strings + 1)
+        text = self.blob(offsets[-1])
+        strings = [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n_strings)]
+        string = lambda i: strings[i] if i != NO_STRING else None
+
+        level_ids = self.column('I', n_levels)
+        level_columns = [self.column('d', n_levels) for _ in LEVEL_COLUMNS]
+        levels = [(strings[level_id],) + values for level_id, values in zip(level_ids, zip(*level_columns))]
+
+        comp_ids = self.column('I', n_comps)
+        depth, width, height, x, y, z = (self.column('d', n_comps) for _ in COMP_COLUMNS)
+        comps = [CfastComparament(strings[comp_ids[i]], depth[i], width[i], height[i], CfastPoint(x[i], y[i], z[i]))
+                 for i in range(n_comps)]
+
+        vent_ids = self.column('I', n_vents)
+        vent_types = self.column('I', n_vents)
+        faces = self.column('i', n_vents)
+        starts = self.column('I', n_vents + 1)
+        refs = self.column('I', n_refs)
+        offset, vent_width, top, bottom = (self.column('d', n_vents) for _ in VENT_COLUMNS)
+        vents = []
+        for i in range(n_vents):
+            vent = CfastWallVent(strings[vent_ids[i]], [strings[r] for r in refs[starts[i]:starts[i + 1]]],
+                                 offset[i], vent_width[i], top[i], bottom[i])
+            vent.type = strings[vent_types[i]]
+            vent.face = string(faces[i])
+            vents.append(vent)
+
+        ceilvents = []
+        if version >= 2:
+            n_ceilvents = self.column('I', 1)[0]
+            ceilvent_ids = self.column('I', n_ceilvents)
+            tops = self.column('i', n_ceilvents)
+            bottoms = self.column('i', n_ceilvents)
+            area, x, y = (self.column('d', n_ceilvents) for _ in CEILVENT_COLUMNS)
+            ceilvents = [CfastCeilingVent(strings[ceilvent_ids[i]], [string(tops[i]), string(bottoms[i])],
+                                          area[i], (x[i], y[i]))
+                         for i in range(n_ceilvents)]
+
+        return CfastBuilding(comps, vents, strings[0] if n_strings else '', levels, ceilvents)
+
+def write_model(stream, building:CfastBuilding) -> None:
+    stream.write(CfastModelWriter().to_bytes(building))
+
+def read_model(buffer) -> CfastBuilding:
+    return CfastModelReader(buffer).building()
+
+'''
+Загрузка модели из файла через отображение в память
+'''
+def load_model(path:str) -> CfastBuilding:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('{}: not a CFAST model file'.format(path))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            reader = CfastModelReader(data)
+            try:
+                return reader.building()
+            finally:
+                reader.view.release()
+
+def is_model(path:str) -> bool:
+    return path.lower().endswith(MODEL_SUFFIX)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Scenario sweep: one CFAST (.in) file per point of a parameter grid, optionally run
+with a local pool of CFAST processes
+
+    python cfast_sweep.py building.svg -o sweep/ -p TIME.SIMULATION=600,3600 \
+        -p INIT.EXTERIOR_TEMPERATURE=-20,20 --run cfast --jobs 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from export_cfast_geometry import CfastProcessing, CfastBuilding, CfastFile, LR, write_lines
+from cfast_batch_export import load_document
+from cfast_mapping_cache import open_cache
+from cfast_model import load_model, is_model, MODEL_SUFFIX
+from cfast_validation import validated
+
+# Количество последних строк вывода запуска, сохраняемых в результате
+OUTPUT_TAIL = 20
+
+'''
+Разбор параметра сетки: BLOCK.NAME=v1,v2,... -> (BLOCK, NAME, [v1, v2, ...])
+'''
+def parse_param(spec:str) -> tuple:
+    name, _, values = spec.partition('=')
+    block, _, key = name.strip().partition('.')
+    block = block.upper()
+    if block not in CfastFile.SCENARIO or not key or not values:
+        raise ValueError('bad parameter {!r}, expected BLOCK.NAME=v1,v2 with BLOCK one of {}'.format(
+                         spec, ', '.join(CfastFile.SCENARIO)))
+    return block, key.strip().upper(), [v.strip() for v in values.split(',')]
+
+'''
+Сетка параметров из файла JSON: {"TIME.SIMULATION": [600, 3600], ...}
+'''
+def load_grid(path:str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        grid = json.load(f)
+    return [parse_param('{}={}'.format(name, ','.join(str(v) for v in values))) for name, values in grid.items()]
+
+'''
+Все сочетания значений параметров сетки: список сценариев {'TIME': {'SIMULATION': '600'}, ...}
+'''
+def scenario_grid(params:list) -> list:
+    scenarios = []
+    for values in itertools.product(*(param[2] for param in params)):
+        scenario = {}
+        for (block, key, _), value in zip(params, values):
+            scenario.setdefault(block, {})[key] = value
+        scenarios.append(scenario)
+    return scenarios
+
+'''
+Запись файла .in для каждого сценария
+
+Геометрия здания формируется и кодируется один раз, для каждого сценария
+записывается только заголовок с параметрами. Описание сценариев сохраняется в <stem>_sweep.json
+'''
+def write_sweep(building:CfastBuilding, scenarios:list, output_dir:str, stem:str) -> list:
+    geometry:bytes = b''.join((line + LR).encode('utf-8')
+                              for line in CfastFile(building.comparaments, building.wallvents,
+                                                    ceilvents=building.ceilvents).geometry_lines())
+    paths = []
+    for i, scenario in enumerate(scenarios):
+        path = os.path.join(output_dir, '{}_{:03d}.in'.format(stem, i + 1))
+        with open(path, 'wb') as stream:
+            write_lines(stream, CfastFile(building.comparaments, building.wallvents, scenario).header_lines())
+            stream.write(geometry)
+        paths.append(path)
+
+    with open(os.path.join(output_dir, stem + '_sweep.json'), 'w', encoding='utf-8') as f:
+        json.dump([{'file': os.path.basename(path), 'scenario': scenario}
+                   for path, scenario in zip(paths, scenarios)], f, ensure_ascii=False, indent=2)
+    return paths
+
+'''
+Запуск расчета одного файла
+
+Команда запускается в директории файла с именем файла последним аргументом,
+как и CFAST: cfast building_001.in
+'''
+def run_case(command:list, in_path:str, timeout:float=None) -> dict:
+    result = {'file': in_path, 'status': None, 'time': 0.0, 'output': ''}
+    t = time.perf_counter()
+    try:
+        proc = subprocess.run(command + [os.path.basename(in_path)], cwd=os.path.dirname(in_path) or None,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+        result['status'] = proc.returncode
+        output = proc.stdout
+    except subprocess.TimeoutExpired as e:
+        result['status'] = 'timeout'
+        output = e.output or b''
+    except OSError as e:
+        result['status'] = 'error'
+        output = str(e).encode('utf-8')
+    result['time'] = time.perf_counter() - t
+    result['output'] = '\n'.join(output.decode('utf-8', 'replace').splitlines()[-OUTPUT_TAIL:])
+    return result
+
+'''
+Запуск расчетов не более чем в jobs процессах одновременно
+
+Каждый поток пула только ожидает свой процесс расчета, поэтому число
+одновременно работающих расчетов ограничено числом потоков.
+Результаты возвращаются в порядке файлов
+'''
+def run_sweep(paths:list, executable:str, jobs:int=None, timeout:float=None) -> list:
+    command = shlex.split(executable)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        return list(pool.map(lambda path: run_case(command, path, timeout), paths))
+
+def print_runs(results:list, wall_time:float, stream=sys.stdout) -> None:
+    failures = [r for r in results if r['status'] != 0]
+    for r in results:
+        stream.write('{:<6}{}  {:.3f}s\n'.format('OK' if r['status'] == 0 else 'FAIL', r['file'], r['time']))
+    stream.write('---------------------------------\n')
+    stream.write('Runs: {}  succeeded: {}  failed: {}  wall time: {:.3f}s\n'.format(
+                 len(results), len(results) - len(failures), len(failures), wall_time))
+    for r in failures:
+        stream.write('=================================\n')
+        stream.write('{}  status: {}\n{}\n'.format(r['file'], r['status'], r['output']))
+
+def main(argv:list=None) -> int:
+    pars = argparse.ArgumentParser(description='Generate CFAST input files for a grid of scenario parameters '
+                                               'and optionally run them')
+    pars.add_argument('svg', help='SVG document or {} file with the building'.format(MODEL_SUFFIX))
+    pars.add_argument('-o', '--output-dir', dest='output_dir', default=None,
+                      help='directory for generated files (default: next to the SVG)')
+    pars.add_argument('-p', '--param', dest='params', action='append', default=[],
+                      help='grid parameter BLOCK.NAME=v1,v2,... (BLOCK: {}), may be repeated'.format(
+                           ', '.join(CfastFile.SCENARIO)))
+    pars.add_argument('--grid', default=None, help='JSON file with the grid: {"TIME.SIMULATION": [600, 3600]}')
+    pars.add_argument('--run', dest='executable', default=None,
+                      help='command to run for each generated file, e.g. cfast or "python stand_in.py"')
+    pars.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(),
+                      help='maximum number of simultaneous runs (default: number of CPUs)')
+    pars.add_argument('--timeout', type=float, default=None, help='time limit of one run in seconds')
+    pars.add_argument('--no-cache', dest='use_cache', action='store_false',
+                      help='do not read or update the per-level mapping cache in the user cache directory '
+                           '($CFAST_CACHE_DIR, $XDG_CACHE_HOME/cfast-inkex or ~/.cache/cfast-inkex)')
+    opt = pars.parse_args(argv)
+
+    try:
+        params = (load_grid(opt.grid) if opt.grid else []) + [parse_param(spec) for spec in opt.params]
+    except (OSError, ValueError) as e:
+        pars.error(str(e))
+
+    svg_name = os.path.basename(opt.svg)
+    stem = os.path.splitext(svg_name)[0]
+    output_dir = opt.output_dir or os.path.dirname(opt.svg)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if is_model(opt.svg):
+        building = load_model(opt.svg)
+    else:
+        cache = open_cache(opt.svg) if opt.use_cache else None
+        document = load_document(opt.svg)
+        with validated(document, lambda line: print('warning: {}'.format(line), file=sys.stderr)):
+            building = CfastProcessing().building(document, svg_name, cache)
+        if cache is not None and not cache.save():
+            print('warning: cache not saved: {}'.format(cache.error), file=sys.stderr)
+    paths = write_sweep(building, scenario_grid(params), output_dir, stem)
+    print('Generated {} files in {}'.format(len(paths), output_dir or '.'))
+
+    if opt.executable is None:
+        return 0
+    t = time.perf_counter()
+    results = run_sweep(paths, opt.executable, opt.jobs, opt.timeout)
+    print_runs(results, time.perf_counter() - t)
+    return 1 if any(r['status'] != 0 for r in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Validation of the whole drawing: all input errors are reported in one run
+"""
+
+import os
+from contextlib import contextmanager
+
+import inkex
+from export_cfast_geometry import CfastProcessing, CfastIdRegistry, CfastProblem, CfastLevel, overlap_pairs
+
+# Максимальное количество ошибок в сообщении экспорта
+MAX_PROBLEMS_IN_MESSAGE = 200
+# Переменная окружения для проверки чертежа перед каждым экспортом: CFAST_VALIDATE=1
+VALIDATE_ENV = 'CFAST_VALIDATE'
+# Ошибки экспорта, которые может вызвать некорректный чертеж. Остальные (ввод-вывод,
+# ошибки в коде) выводятся как есть, без подмены списком ошибок чертежа
+GEOMETRY_ERRORS = (inkex.AbortExtension, KeyError, IndexError, ValueError)
+
+'''
+Пары прямоугольников, которые перекрываются по площади (проход по оси X, overlap_pairs)
+'''
+def overlaps(rects:dict, snap:int=0) -> list:
+    return [(a, b) for a, b, _ in overlap_pairs(rects, snap=snap)]
+
+'''
+Проверка дверей этажа по касаниям, найденным тем же поиском, что и при экспорте
+
+Дверь должна касаться одного или двух помещений хотя бы двумя углами и лежать
+на стене помещения, относительно которого вычисляется ее положение
+'''
+def check_wallvents(level:CfastLevel, processing:CfastProcessing, problems:list) -> None:
+    contacts = processing.contacts_numpy if processing.use_numpy else processing.contacts
+    touches = {}
+    for comp_rect_id, vent_rect_id in contacts(level.comps_raw, level.wallvents_raw):
+        touches.setdefault(vent_rect_id, []).append(comp_rect_id)
+
+    comp_key = processing.registry.keys.__getitem__
+    for vent_rect_id, wallvent_raw in level.wallvents_raw.items():
+        hits = touches.get(vent_rect_id)
+        if hits is None:
+            problems.append(CfastProblem(level.id, 'дверь не касается ни одного помещения', (vent_rect_id,)))
+            continue
+        comp_ids = sorted(set(hits), key=comp_key)
+        ids = (vent_rect_id,) + tuple(comp_ids)
+        if len(comp_ids) > 2:
+            problems.append(CfastProblem(level.id, 'дверь касается более двух помещений', ids))
+        elif len(hits) == 1:
+            problems.append(CfastProblem(level.id, 'в помещении находится только один угол двери', ids))
+        elif processing.wallvent_geometry(wallvent_raw, level.comps_raw[comp_ids[0]]) is None:
+            problems.append(CfastProblem(level.id, 'дверь не лежит на стене помещения', ids))
+
+'''
+Проверка документа: все найденные ошибки ввода
+
+Проверяются масштаб и привязка этажей, id прямоугольников, пересечения помещений,
+пересечения дверей, двери вне помещений, двери в трех и более помещениях,
+двери, которые не лежат на стене помещения, проемы в перекрытиях вне помещений
+'''
+def validate(root, processing:CfastProcessing=None) -> list:
+    processing = processing or CfastProcessing()
+    problems = []
+    levels = processing.collect(root, problems)
+
+    # Прямоугольники с некорректными id получают общий номер, чтобы проверка продолжалась
+    registry = CfastIdRegistry()
+    for level in levels:
+        invalid = len(registry.invalid)
+        for rect_id in list(level.comps_raw) + list(level.wallvents_raw) + list(level.openings_raw):
+            registry.add(rect_id)
+        if len(registry.invalid) > invalid:
+            problems.append(CfastProblem(level.id, 'идентификатор прямоугольника должен иметь вид rect<N>',
+                                         registry.invalid[invalid:]))
+    for rect_id in registry.invalid:
+        registry.keys[rect_id] = -1
+    processing.registry = registry
+
+    for level in levels:
+        for a, b in overlaps(level.comps_raw, processing.snap):
+            problems.append(CfastProblem(level.id, 'пересечение помещений', (a, b)))
+        for a, b in overlaps(level.wallvents_raw, processing.snap):
+            problems.append(CfastProblem(level.id, 'пересечение дверей', (a, b)))
+        check_wallvents(level, processing, problems)
+
+    try:
+        processing.link_levels(levels)
+    except inkex.AbortExtension as error:
+        problems.append(CfastProblem(None, str(error)))
+
+    # Проем в перекрытии должен лежать в помещении этажа или этажа ниже
+    for i, level in enumerate(levels):
+        if not level.openings_raw: continue
+        touched = {opening_id for opening_id, _, _ in overlap_pairs(level.openings_raw, level.comps_raw, processing.snap)}
+        if i:
+            touched.update(opening_id for opening_id, _, _ in
+                           overlap_pairs(level.openings_raw, levels[i - 1].comps_raw, processing.snap))
+        for opening_id in level.openings_raw:
+            if opening_id not in touched:
+                problems.append(CfastProblem(level.id, 'проем в перекрытии не лежит ни в одном помещении',
+                                             (opening_id,)))
+    return problems
+
+def report(problems:list, limit:int=None) -> list:
+    lines = ['Найдено ошибок: {}'.format(len(problems))]
+    shown = problems if limit is None else problems[:limit]
+    lines.extend(str(problem) for problem in shown)
+    if len(shown) < len(problems):
+        lines.append('... и еще {}'.format(len(problems) - len(shown)))
+    return lines
+
+'''
+Полный список ошибок чертежа при прерывании экспорта
+
+Если экспорт прервался из-за ошибки, которую может вызвать чертеж (GEOMETRY_ERRORS),
+документ проверяется целиком и вместо первой ошибки выводится список всех найденных.
+Корректные документы не проверяются повторно. Проверка перед экспортом удваивает
+его время, поэтому включается только переменной CFAST_VALIDATE=1: тогда найденные
+ошибки выводятся через warn как предупреждения, а экспорт продолжается
+'''
+@contextmanager
+def validated(root, warn=None, snap:int=None):
+    problems = None
+    if warn is not None and os.environ.get(VALIDATE_ENV) == '1':
+        problems = validate(root, CfastProcessing(snap=snap))
+        if problems:
+            warn('Внимание! Чертеж содержит ошибки, результат экспорта может быть некорректным.')
+            for line in report(problems, MAX_PROBLEMS_IN_MESSAGE):
+                warn(line)
+    try:
+        yield
+    except GEOMETRY_ERRORS as error:
+        if problems is None:
+            problems = validate(root, CfastProcessing(snap=snap))
+        if not problems:
+            raise
+        raise inkex.AbortExtension('\n'.join(report(problems, MAX_PROBLEMS_IN_MESSAGE))) from error
+
+class CfastValidation(inkex.EffectExtension):
+    def effect(self):
+        problems = validate(self.svg)
+        if not problems:
+            self.msg('Ошибок не найдено')
+            return
+        for line in report(problems):
+            self.msg(line)
+
+if __name__ == '__main__':
+    CfastValidation().run()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export CFAST (.in) and Smokeview (.smv) files in one pass (.zip)
+"""
+
+import os
+import zipfile
+
+import inkex
+from export_cfast_geometry import CfastBuilding, CfastFile, CfastStreamFile, LR, CfastExtensionExport, \
+                                  CfastExportSummary, export_extension
+from export_smv_geometry import SmvFile, SmvStreamFile
+from cfast_model import write_model, MODEL_SUFFIX
+
+def write_cfast(stream, building:CfastBuilding) -> None:
+    CfastFile(building.comparaments, building.wallvents, ceilvents=building.ceilvents).write_to(stream)
+
+def write_smv(stream, building:CfastBuilding) -> None:
+    SmvFile.from_building(building).write_to(stream)
+    stream.write(LR.encode('utf-8'))
+
+# Форматы экспорта: расширение файла -> функция записи здания в бинарный поток
+# Новый формат достаточно добавить в этот словарь
+FORMATS = {
+    'in': write_cfast,
+    'smv': write_smv,
+    MODEL_SUFFIX.lstrip('.'): write_model,
+}
+# Форматы, которые записываются по умолчанию
+DEFAULT_FORMATS = ('in', 'smv')
+# Форматы с потоковой записью по этажам: расширение файла -> writer для CfastProcessing.stream
+STREAM_FORMATS = {
+    'in': lambda stream, name: CfastStreamFile(stream),
+    'smv': lambda stream, name: SmvStreamFile(stream, name, end=LR),
+}
+
+'''
+Запись здания во все указанные форматы в zip-архив
+'''
+def write_bundle(stream, building:CfastBuilding, formats:tuple=DEFAULT_FORMATS) -> list:
+    stem = os.path.splitext(building.name)[0] or 'building'
+    names = []
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for fmt in formats:
+            name = '{}.{}'.format(stem, fmt)
+            with bundle.open(name, 'w') as entry:
+                FORMATS[fmt](entry, building)
+            names.append(name)
+    return names
+
+class ExportCfastBundle(inkex.OutputExtension):
+    def save(self, stream):
+        export_extension(self, lambda export: self.save_building(export, stream))
+
+    def save_building(self, export:CfastExtensionExport, stream) -> CfastExportSummary:
+        building = export.building()
+        with export.phase():
+            names = write_bundle(stream, building)
+        return CfastExportSummary.of_building(building, notes=['Файлы: {}'.format(', '.join(names))])
+
+if __name__ == '__main__':
+    ExportCfastBundle().run()
@@ -19,11 +19,44 @@
 Export a cfast geometry file (.in)
 """
 
+import cProfile
+import heapq
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice, repeat
+
 import inkex
-from inkex import ShapeElement, Layer, Rectangle, Circle, Ellipse
+from inkex import Group, Layer, Rectangle, Circle, Ellipse
+import cfast_fixed
+from cfast_fixed import to_units, to_metres, snap_from_env
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 LR = '\n'
 DEFAULT_HEIGHT_LEVEL = 3.0
+# Переменная окружения с количеством процессов для параллельной обработки этажей
+JOBS_ENV = 'CFAST_JOBS'
+# Переменная окружения с путем файла для сохранения профиля cProfile
+PROFILE_ENV = 'CFAST_PROFILE'
+# Количество строк файла, выводимых в окно сообщений после экспорта
+PREVIEW_LINES = 40
+# Переменная окружения для потоковой обработки по этажам: CFAST_STREAM=1
+STREAM_ENV = 'CFAST_STREAM'
+# Ограничение CFAST на количество помещений в одной модели
+MAX_COMPARAMENTS = 100
+# Количество проемов, после которого расчет CFAST заметно замедляется
+MAX_WALLVENTS = 100
 
 class CfastFace:
     REAR  = 'REAR'
@@ -32,6 +65,8 @@ class CfastFace:
     RIGHT = 'RIGHT'
 
 class CfastPoint:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x:float, y:float, z:float):
         self.x = x
         self.y = y
@@ -41,6 +76,8 @@ class CfastPoint:
         return '({},{},{})'.format(round(self.x, 2), round(self.y, 2), round(self.z, 2))
 
 class CfastPolygon(list):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(CfastPolygon, self).__init__(args)
     
@@ -48,6 +85,8 @@ class Segment:
     HORISONTAL = 0
     VERTICAL = 1
 
+    __slots__ = ('p1', 'p2')
+
     def __init__(self, p1:CfastPoint, p2:CfastPoint):
         self.p1 = p1
         self.p2 = p2
@@ -56,6 +95,8 @@ class Segment:
         return '[{},{}]'.format(self.p1, self.p2)
 
 class CfastScale:
+    __slots__ = ('k_height', 'k_width')
+
     def __init__(self, k_height:float, k_width:float):
         self.k_height = k_height
         self.k_width  = k_width
@@ -69,39 +110,182 @@ class CfastScale:
     def convert(self, value:float, k:float) -> float:
         return round(value * k, 3)
 
+def write_lines(stream, lines, encoding:str='utf-8') -> None:
+    '''
+    Запись строк в поток, каждая строка завершается переводом строки
+    Текстовые потоки получают строки, бинарные - байты в указанной кодировке
+    '''
+    binary = not isinstance(stream, io.TextIOBase)
+    for line in lines:
+        line += LR
+        stream.write(line.encode(encoding) if binary else line)
+
 class CfastFile:
     HEAD = "&HEAD VERSION = 7600, TITLE = 'CFAST Simulation' /"
     TAIL = "&TAIL /"
-    TIME = "&TIME SIMULATION = 3600 PRINT = 60 SMOKEVIEW = 15 SPREADSHEET = 15 /"
-    INIT = "&INIT PRESSURE = 101325 RELATIVE_HUMIDITY = 50 INTERIOR_TEMPERATURE = 20 EXTERIOR_TEMPERATURE = 20 /"   
-    MISC = "&MISC LOWER_OXYGEN_LIMIT = 0.15 ADIABATIC = .TRUE. /"
+    COMPARTMENTS = "!! Compartments"
+    WALLVENTS = "!! Wall vents"
+    CEILVENTS = "!! Ceiling and floor vents"
+    # Параметры сценария по умолчанию: блок -> {параметр: значение} в порядке записи в файл
+    SCENARIO = {
+        'TIME': {'SIMULATION': 3600, 'PRINT': 60, 'SMOKEVIEW': 15, 'SPREADSHEET': 15},
+        'INIT': {'PRESSURE': 101325, 'RELATIVE_HUMIDITY': 50, 'INTERIOR_TEMPERATURE': 20, 'EXTERIOR_TEMPERATURE': 20},
+        'MISC': {'LOWER_OXYGEN_LIMIT': 0.15, 'ADIABATIC': '.TRUE.'},
+    }
     
     # comparaments - array of class CfastComparament
     # wallvents - array of class CfastWallvents
-    def __init__(self, comparaments:list, wallvents:list):
+    # scenario - параметры сценария, которые заменяют значения по умолчанию: {'TIME': {'SIMULATION': 600}}
+    # ceilvents - array of class CfastCeilingVent
+    def __init__(self, comparaments:list, wallvents:list, scenario:dict=None, ceilvents:list=None):
         self.comparaments = comparaments
         self.wallvents = wallvents
+        self.scenario = scenario or {}
+        self.ceilvents = ceilvents or []
     
     def to_string(self) -> str:
-        content = self.HEAD + LR
-        
-        content += LR + "!! Scenario Configuration" + LR
-        content += self.TIME + LR
-        content += self.INIT + LR
-        content += self.MISC + LR
+        return LR.join(self.lines())
+
+    '''
+    Построчная генерация содержимого файла
+
+    Запись помещения или проема может занимать несколько строк файла
+    '''
+    def lines(self):
+        yield from self.header_lines()
+        yield from self.geometry_lines()
+
+    '''
+    Заголовок файла с параметрами сценария
+    '''
+    def header_lines(self):
+        yield self.HEAD
+
+        yield ''
+        yield "!! Scenario Configuration"
+        for block, defaults in self.SCENARIO.items():
+            params = dict(defaults, **self.scenario.get(block, {}))
+            yield '&{} {} /'.format(block, ' '.join('{} = {}'.format(k, v) for k, v in params.items()))
 
-        content += LR + "!! Compartments" + LR
+    '''
+    Геометрия здания: не зависит от параметров сценария
+    '''
+    def geometry_lines(self):
+        yield ''
+        yield self.COMPARTMENTS
         for comp in self.comparaments:
-            content += str(comp) + LR
-        
-        content += LR + "!! Wall vents" + LR
+            yield str(comp)
+
+        yield ''
+        yield self.WALLVENTS
         for wallvent in self.wallvents:
-            content += str(wallvent) + LR
+            yield str(wallvent)
+
+        # Секция проемов в перекрытиях записывается, только если они есть
+        if self.ceilvents:
+            yield ''
+            yield self.CEILVENTS
+            for ceilvent in self.ceilvents:
+                yield str(ceilvent)
+
+        yield ''
+        yield self.TAIL
+
+    '''
+    Потоковая запись файла без формирования всего содержимого в памяти
+    '''
+    def write_to(self, stream, encoding:str='utf-8') -> None:
+        write_lines(stream, self.lines(), encoding)
+
+class CfastSpool:
+    '''
+    Временный файл с упорядоченными по ключу сериями записей
+
+    Каждая серия (например, проемы одного этажа) записывается отсортированной по ключу,
+    merged() возвращает записи всех серий в порядке ключа, читая из файла по одной
+    записи каждой серии. При равных ключах раньше идут записи более ранней серии,
+    как при устойчивой сортировке всех записей сразу
+    '''
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.runs = []
+
+    def add_run(self, records) -> None:
+        start = self.file.tell()
+        count = 0
+        for key, payload in records:
+            self.file.write(json.dumps((key, payload)).encode('utf-8') + b'\n')
+            count += 1
+        self.runs.append((start, count))
 
-        content += LR + self.TAIL
-        return content
+    def read_run(self, start:int, count:int):
+        position = start
+        for _ in range(count):
+            self.file.seek(position)
+            line = self.file.readline()
+            position = self.file.tell()
+            yield json.loads(line)
+
+    def merged(self):
+        runs = [self.read_run(start, count) for start, count in self.runs]
+        for _, payload in heapq.merge(*runs, key=lambda record: record[0]):
+            yield payload
+
+    def close(self) -> None:
+        self.file.close()
+
+class CfastStreamFile:
+    '''
+    Потоковая запись файла CFAST по этажам
+
+    Помещения этажа записываются сразу, проемы - во временный файл, так как в файле CFAST
+    все проемы следуют после всех помещений в порядке id по всему зданию.
+    Результат совпадает с CfastFile для тех же помещений и проемов
+    '''
+    def __init__(self, stream, scenario:dict=None, encoding:str='utf-8'):
+        self.stream = stream
+        self.scenario = scenario
+        self.encoding = encoding
+        self.spool = CfastSpool()
+        self.ceil_spool = CfastSpool()
+        self.comparaments = 0
+        self.wallvents = 0
+        self.ceilvents = 0
+        self.preview = []
+
+    def write(self, lines) -> None:
+        lines = list(lines)
+        if len(self.preview) <= PREVIEW_LINES:
+            self.preview.extend(lines[:PREVIEW_LINES + 1 - len(self.preview)])
+        write_lines(self.stream, lines, self.encoding)
+
+    def begin(self) -> None:
+        self.write(CfastFile([], [], self.scenario).header_lines())
+        self.write(('', CfastFile.COMPARTMENTS))
+
+    def add_level(self, comparaments:list, wallvents:list, registry, ceilvents:list=()) -> None:
+        self.write(str(comp) for comp in comparaments)
+        self.spool.add_run((registry.keys[wallvent.id], str(wallvent)) for wallvent in wallvents)
+        self.ceil_spool.add_run((registry.keys[ceilvent.id], str(ceilvent)) for ceilvent in ceilvents)
+        self.comparaments += len(comparaments)
+        self.wallvents += len(wallvents)
+        self.ceilvents += len(ceilvents)
+
+    def finish(self) -> None:
+        self.write(('', CfastFile.WALLVENTS))
+        for text in self.spool.merged():
+            self.write((text,))
+        if self.ceilvents:
+            self.write(('', CfastFile.CEILVENTS))
+            for text in self.ceil_spool.merged():
+                self.write((text,))
+        self.write(('', CfastFile.TAIL))
+        self.spool.close()
+        self.ceil_spool.close()
 
 class CfastComparament():
+    __slots__ = ('id', 'depth', 'width', 'height', 'origin')
+
     def __init__(self, id:str, depth:float, width:float, height:float, origin:CfastPoint):
         self.id = id
         self.depth = depth
@@ -118,6 +302,8 @@ class CfastComparament():
 class CfastWallVent():
     OUTSIDE = 'OUTSIDE'
 
+    __slots__ = ('type', 'id', 'comp_ids', 'offset', 'width', 'top', 'bottom', 'face')
+
     def __init__(self, id:str, comp_ids:list, offset:float, width:float, top=float(2), bottom=float(0)):
         self.type = 'WALL'
         self.id:str = id
@@ -140,7 +326,43 @@ class CfastWallVent():
                '      BOTTOM = {bottom} HEIGHT = {height} WIDTH = {width}\n'.format(bottom=self.bottom, height=self.top, width=self.width) + \
                '      FACE = \'{face}\' OFFSET = {offset} /'.format(face=self.face, offset=self.offset)
 
+class CfastCeilingVent():
+    '''
+    Проем в перекрытии: лестница, шахта, отверстие между этажами
+
+    comp_ids - [верхнее помещение, нижнее помещение], None - снаружи здания
+    area - площадь проема
+    offsets - центр проема относительно начала верхнего помещения (нижнего, если верхнего нет)
+    '''
+    OUTSIDE = 'OUTSIDE'
+    SHAPE = 'SQUARE'
+
+    __slots__ = ('type', 'id', 'comp_ids', 'area', 'offsets')
+
+    def __init__(self, id:str, comp_ids:list, area:float, offsets:tuple):
+        self.type = 'CEILING'
+        self.id:str = id
+        self.comp_ids:list = comp_ids
+        self.area = area
+        self.offsets = offsets
+
+    def __str__(self):
+        comp_ids = ', '.join('\'{}\''.format(self.OUTSIDE if comp_id is None else comp_id) for comp_id in self.comp_ids)
+        return '&VENT TYPE = \'{vent_type}\' ID = \'{id}\'\n'.format(vent_type=self.type, id=self.id) + \
+               '      COMP_IDS = {comp_ids}\n'.format(comp_ids=comp_ids) + \
+               '      AREA = {area} SHAPE = \'{shape}\' OFFSETS = {x}, {y} /'.format(area=self.area, shape=self.SHAPE,
+                                                                                x=self.offsets[0], y=self.offsets[1])
+
 class CfastRectangle():
+    '''
+    Прямоугольник помещения или двери в координатах CFAST
+
+    Хранит только границы. Углы, стороны и габарит в целых миллиметрах (box) строятся
+    при первом обращении и сбрасываются при смещении, поэтому прямоугольники, которые
+    не участвуют в обработке дверей, не создают лишних объектов
+    '''
+    __slots__ = ('rect', 'scale', 'x0', 'y0', 'z0', 'width', 'height', '_points', '_segments', '_box')
+
     def __init__(self, rect:Rectangle, z:float, scale:CfastScale):
         self.rect:Rectangle = rect
         self.scale = scale
@@ -151,132 +373,897 @@ class CfastRectangle():
         self.width  = scale.convert_width(rect.width)
         self.height = scale.convert_depth(rect.height)
         
-        self.init_points_and_segments()
+        self._points = None
+        self._segments = None
+        self._box = None
 
     def set_offset(self, dx:float, dy:float):
         self.x0 = round(self.x0 + dx, 4)
         self.y0 = round(self.y0 + dy, 4)
-        self.init_points_and_segments()
+        self._points = None
+        self._segments = None
+        self._box = None
 
-    def init_points_and_segments(self):
-        x1 = self.x0 + self.width
-        y1 = self.y0 + self.height
-        
-        self.p0 = CfastPoint(self.x0, self.y0, self.z0)
-        self.p1 = CfastPoint(x1, self.y0, self.z0)
-        self.p2 = CfastPoint(x1, y1, self.z0)
-        self.p3 = CfastPoint(self.x0, y1, self.z0)
-    
-        self.front = Segment(self.p3, self.p0)
-        self.left  = Segment(self.p0, self.p1)
-        self.rear  = Segment(self.p1, self.p2)
-        self.right = Segment(self.p2, self.p3)
+    # При передаче в другой процесс сохраняются только границы прямоугольника,
+    # элемент документа не передается
+    def __getstate__(self):
+        return (self.x0, self.y0, self.z0, self.width, self.height)
+
+    def __setstate__(self, state):
+        self.rect = None
+        self.scale = None
+        self.x0, self.y0, self.z0, self.width, self.height = state
+        self._points = None
+        self._segments = None
+        self._box = None
+
+    '''
+    Габарит (x0, y0, x1, y1) в целых миллиметрах (cfast_fixed.box)
+    '''
+    @property
+    def box(self) -> tuple:
+        if self._box is None:
+            self._box = cfast_fixed.box(self)
+        return self._box
+
+    def get_points(self) -> tuple:
+        if self._points is None:
+            x1 = self.x0 + self.width
+            y1 = self.y0 + self.height
+            self._points = (CfastPoint(self.x0, self.y0, self.z0),
+                            CfastPoint(x1, self.y0, self.z0),
+                            CfastPoint(x1, y1, self.z0),
+                            CfastPoint(self.x0, y1, self.z0))
+        return self._points
+
+    p0 = property(lambda self: self.get_points()[0])
+    p1 = property(lambda self: self.get_points()[1])
+    p2 = property(lambda self: self.get_points()[2])
+    p3 = property(lambda self: self.get_points()[3])
 
     def get_polygon(self) -> CfastPolygon:
-        return CfastPolygon(self.p0, self.p1, self.p2, self.p3)
+        return CfastPolygon(*self.get_points())
     
     def get_segments(self):
-        return (self.left, self.rear, self.right, self.front)
+        if self._segments is None:
+            p0, p1, p2, p3 = self.get_points()
+            # left, rear, right, front
+            self._segments = (Segment(p0, p1), Segment(p1, p2), Segment(p2, p3), Segment(p3, p0))
+        return self._segments
+
+    left  = property(lambda self: self.get_segments()[0])
+    rear  = property(lambda self: self.get_segments()[1])
+    right = property(lambda self: self.get_segments()[2])
+    front = property(lambda self: self.get_segments()[3])
+
+'''
+Видимость прямоугольника по значению атрибута style: элементы без обводки не экспортируются
+'''
+def is_visible(style:str) -> bool:
+    for style_attr in (style or '').split(';'):
+        s = style_attr.split(':')
+        if s[0] == 'stroke' and s[1] == 'none':
+            return False
+    return True
+
+'''
+Слои этажей Level* в порядке документа
+
+Вне слоев этажей просматриваются вложенные слои и группы (Layer - частный случай Group),
+слои внутри этажа не считаются этажами
+'''
+def level_layers(group):
+    for elem in group.iterchildren():
+        if not isinstance(elem, Group): continue
+        if isinstance(elem, Layer) and 'level' in (elem.label or '').lower():
+            yield elem
+        else:
+            yield from level_layers(elem)
+
+'''
+Пересекающиеся по площади прямоугольники: (id из rects, id из others, площадь пересечения)
+
+Без others ищутся пары внутри rects. Прямоугольники просматриваются по возрастанию x0,
+активными остаются те, что еще не закончились по x; они хранятся упорядоченными по y0,
+поэтому для очередного прямоугольника проверяются только активные с y0 в пределах
+[y0 - наибольшая высота, y1): на планах зданий это O(n log n) плюс количество пар.
+Габариты сравниваются в целых миллиметрах, перекрытия не больше snap не учитываются
+'''
+def overlap_pairs(rects:dict, others:dict=None, snap:int=cfast_fixed.DEFAULT_SNAP) -> list:
+    sets = (rects,) if others is None else (rects, others)
+    items = sorted(r.box + (kind, rect_id) for kind, group in enumerate(sets) for rect_id, r in group.items()
+                   if r.box[2] - r.box[0] > snap and r.box[3] - r.box[1] > snap)
+    max_height = [0] * len(sets)
+    for item in items:
+        max_height[item[4]] = max(max_height[item[4]], item[3] - item[1])
+
+    ends = []
+    active = [[] for _ in sets]
+    pairs = []
+    for seq, (x0, y0, x1, y1, kind, rect_id) in enumerate(items):
+        while ends and ends[0][0] <= x0 + snap:
+            _, old = heapq.heappop(ends)
+            old_active = active[items[old][4]]
+            del old_active[bisect_left(old_active, (items[old][1], old))]
+        other_kind = 0 if others is None else 1 - kind
+        candidates = active[other_kind]
+        lo = bisect_left(candidates, (y0 - max_height[other_kind], -1))
+        hi = bisect_left(candidates, (y1 - snap, -1))
+        for _, other in candidates[lo:hi]:
+            ox0, oy0, ox1, oy1, _, other_id = items[other]
+            dy = min(y1, oy1) - max(y0, oy0)
+            if dy > snap:
+                area = to_metres(min(x1, ox1) - x0) * to_metres(dy)
+                pairs.append((rect_id, other_id, area) if kind == 0 and others is not None else (other_id, rect_id, area))
+        heapq.heappush(ends, (x1, seq))
+        insort(active[kind], (y0, seq))
+    return pairs
+
+class CfastProblem:
+    '''
+    Ошибка ввода: этаж, описание и id элементов, к которым она относится
+    '''
+    __slots__ = ('level', 'message', 'ids')
+
+    def __init__(self, level:str, message:str, ids:tuple=()):
+        self.level = level
+        self.message = message
+        self.ids = tuple(ids)
+
+    def __str__(self):
+        where = '{}: '.format(self.level) if self.level else ''
+        ids = ' ({})'.format(', '.join(self.ids)) if self.ids else ''
+        return where + self.message + ids
+
+class CfastLevel:
+    '''
+    Этаж здания: прямоугольники помещений и дверей, точки привязки и смещение этажа
+    '''
+    def __init__(self, id:str, z:float, scale:CfastScale, link:list=None):
+        self.id = id
+        self.z = z
+        self.scale = scale
+        self.link = link # [id точки привязки нижнего этажа, id точки привязки этого этажа]
+        self.comps_raw = {}
+        self.wallvents_raw = {}
+        self.openings_raw = {}
+        self.spots = {}
+        self.offset = (0.0, 0.0)
+
+    '''
+    Этаж по слою Level*
+
+    Если масштаб этажа не задан, экспорт прерывается. При проверке документа (problems - список
+    найденных ошибок) ошибка добавляется в список, а этаж читается в масштабе 1:1
+    '''
+    @classmethod
+    def from_layer(cls, layer:Layer, z:float, problems:list=None):
+        try:
+            scale = CfastScale(float(layer.get('cfast:k_width')), float(layer.get('cfast:k_height')))
+        except (TypeError, ValueError):
+            problem = CfastProblem(layer.get_id(), 'не задан масштаб этажа {} (cfast:k_width, cfast:k_height), '
+                                                   'выполните привязку геометрии'.format(layer.label))
+            if problems is None:
+                raise inkex.AbortExtension(str(problem))
+            problems.append(problem)
+            scale = CfastScale(1.0, 1.0)
+        link_id = layer.get('cfast:link_id')
+        return cls(layer.get_id(), z, scale, link_id.split(',') if link_id is not None else None)
+
+    def add_spot(self, elem:Circle) -> None:
+        self.spots[elem.get_id()] = {'x':self.scale.convert_width(elem.center[0]),
+                                     'y':-self.scale.convert_depth(elem.center[1])}
+
+class CfastIdRegistry:
+    '''
+    Числовые номера id прямоугольников здания
+
+    Создается один раз после сбора этажей: id вида rect<N> (у копий - rect<N>-<M>)
+    разбираются в целые числа, по которым упорядочиваются помещения и проемы в файлах.
+    Прямоугольники с другими id перечисляются в ошибке все сразу
+    '''
+    PATTERN = re.compile(r'rect(\d+(?:-\d+)*)')
+    MAX_IDS_IN_ERROR = 20
+
+    def __init__(self):
+        self.keys = {}
+        self.invalid = []
+
+    def add(self, id:str) -> None:
+        match = self.PATTERN.fullmatch(id)
+        if match is None:
+            self.invalid.append(id)
+        else:
+            self.keys[id] = int(match.group(1).replace('-', ''))
+
+    @classmethod
+    def from_ids(cls, ids):
+        registry = cls()
+        for id in ids:
+            registry.add(id)
+        registry.check()
+        return registry
+
+    @classmethod
+    def from_levels(cls, levels:list):
+        registry = cls()
+        for level in levels:
+            for id in level.comps_raw:
+                registry.add(id)
+            for id in level.wallvents_raw:
+                registry.add(id)
+            for id in level.openings_raw:
+                registry.add(id)
+        registry.check()
+        return registry
+
+    def check(self) -> None:
+        if not self.invalid: return
+        ids = ', '.join(self.invalid[:self.MAX_IDS_IN_ERROR])
+        if len(self.invalid) > self.MAX_IDS_IN_ERROR:
+            ids += ' ... (всего {})'.format(len(self.invalid))
+        raise inkex.AbortExtension('Идентификаторы прямоугольников должны иметь вид rect<N>: {}'.format(ids))
+
+class CfastGridIndex:
+    '''
+    Равномерная сетка для поиска прямоугольников одного уровня
+
+    Каждый прямоугольник регистрируется во всех ячейках, которые перекрывает его габарит.
+    Запрос возвращает ключи прямоугольников, габариты которых могут пересекаться с заданным,
+    в порядке их добавления в индекс.
+    '''
+    EPS = 1e-6
+
+    def __init__(self, cell_size:float):
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+        self.cells = {}
+        self.keys = []
+
+    def cell_range(self, rect:CfastRectangle, eps:float=0.0):
+        c = self.cell_size
+        i0 = math.floor((rect.x0 - eps) / c)
+        j0 = math.floor((rect.y0 - eps) / c)
+        i1 = math.floor((rect.x0 + rect.width + eps) / c)
+        j1 = math.floor((rect.y0 + rect.height + eps) / c)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                yield (i, j)
+
+    def insert(self, key, rect:CfastRectangle):
+        order = len(self.keys)
+        self.keys.append(key)
+        for cell in self.cell_range(rect):
+            self.cells.setdefault(cell, []).append(order)
+
+    def query(self, rect:CfastRectangle, eps:float=EPS) -> list:
+        found = set()
+        for cell in self.cell_range(rect, max(eps, self.EPS)):
+            found.update(self.cells.get(cell, ()))
+        return [self.keys[order] for order in sorted(found)]
+
+class CfastStats:
+    '''
+    Статистика экспорта: время этапов, количество проверок и состав этажей
+    '''
+    # Максимальное количество этажей в отчете
+    MAX_LEVELS_IN_REPORT = 50
+
+    def __init__(self):
+        self.timings = {}
+        self.point_tests = 0
+        self.intersect_tests = 0
+        self.levels = []
+
+    @contextmanager
+    def phase(self, name:str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t)
+
+    def add_time(self, name:str, seconds:float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    # Объединение со статистикой, собранной в другом процессе
+    def merge(self, other) -> None:
+        for name, seconds in other.timings.items():
+            self.add_time(name, seconds)
+        self.point_tests += other.point_tests
+        self.intersect_tests += other.intersect_tests
+
+    def report(self) -> list:
+        lines = ['Время этапов:']
+        lines += ['  {}: {:.3f} с'.format(name, seconds) for name, seconds in self.timings.items()]
+        lines.append('Проверок попадания точки в помещение: {}'.format(self.point_tests))
+        lines.append('Проверок пересечения отрезков: {}'.format(self.intersect_tests))
+        lines.append('Этажи:')
+        for level_id, z, rooms, doors, vents, cached in self.levels[:self.MAX_LEVELS_IN_REPORT]:
+            lines.append('  {} (z = {}): помещений {}, дверей {}, проемов {}{}'.format(
+                         level_id, z, rooms, doors, vents, ', из кэша' if cached else ''))
+        if len(self.levels) > self.MAX_LEVELS_IN_REPORT:
+            lines.append('  ... еще этажей: {}'.format(len(self.levels) - self.MAX_LEVELS_IN_REPORT))
+        return lines
+
+class CfastBuilding:
+    '''
+    Результат сопоставления геометрии: упорядоченные помещения и проемы здания
+
+    Один объект передается всем форматам экспорта, поэтому mapping и
+    индекс помещений вычисляются один раз на документ
+
+    levels - этажи: (id, высота, k_width, k_height, смещение по x, смещение по y)
+    ceilvents - проемы в перекрытиях (CfastCeilingVent)
+    '''
+    def __init__(self, comparaments:list, wallvents:list, name:str='', levels:list=None, ceilvents:list=None):
+        self.comparaments = comparaments
+        self.wallvents = wallvents
+        self.name = name
+        self.levels = levels or []
+        self.ceilvents = ceilvents or []
+        self._comps_index = None
+
+    '''
+    Индекс помещений: id -> (номер помещения в файле начиная с 1, помещение)
+    '''
+    def comps_index(self) -> dict:
+        if self._comps_index is None:
+            self._comps_index = {comp.id: (i+1, comp) for i, comp in enumerate(self.comparaments)}
+        return self._comps_index
 
 class CfastProcessing:
+    # Максимальное количество элементов в одной матрице проверок движка NumPy
+    NUMPY_CHUNK = 1 << 20
+    # Грани помещения в порядке сторон get_segments
+    COMP_FACES = (CfastFace.FRONT, CfastFace.RIGHT, CfastFace.REAR, CfastFace.LEFT)
+
+    # jobs - количество процессов для параллельной обработки этажей, 1 - без параллелизма
+    # batch_vents - двери этажа вычисляются одним проходом по границам прямоугольников (resolve_wallvents),
+    #               иначе - через process_wallvent при каждом касании
+    # snap - допуск касания в миллиметрах
+    def __init__(self, use_numpy:bool=None, jobs:int=1, batch_vents:bool=True, snap:int=None):
+        # По умолчанию используется NumPy, если он установлен
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy and numpy is not None
+        self.jobs = max(1, jobs or 1)
+        self.batch_vents = batch_vents
+        # Допуск касания в миллиметрах (cfast_fixed), по умолчанию из переменной окружения CFAST_SNAP
+        self.snap = snap_from_env() if snap is None else max(0, snap)
+        # Номера id прямоугольников документа, создаются в mapping
+        self.registry:CfastIdRegistry = None
+        self.stats = CfastStats()
+        self.levels = []
+        # Проемы в перекрытиях последнего сопоставления в порядке записи в файл
+        self.ceilvents = []
+
+    '''
+    Сопоставление геометрии документа: поиск помещений и соединяющих их проемов
+
+    cache - кэш результатов по этажам (cfast_mapping_cache.CfastMappingCache),
+    этажи без изменений берутся из кэша без повторного сопоставления
+    '''
+    def mapping(self, elements, inkex=None, cache=None) -> None:
+        with self.stats.phase('collect'):
+            levels = self.collect(elements)
+            self.registry = CfastIdRegistry.from_levels(levels)
+        self.levels = levels
+        with self.stats.phase('link'):
+            self.link_levels(levels)
+
+        with self.stats.phase('match'):
+            results = [cache.lookup(level, self.snap) if cache is not None else None for level in levels]
+            pending = [level for level, result in zip(levels, results) if result is None]
+            matched = iter(self.match_levels(pending))
+
+            comparaments = {}
+            wallvents = {}
+            for level, result in zip(levels, results):
+                cached = result is not None
+                if not cached:
+                    result = next(matched)
+                    if cache is not None:
+                        cache.store(level, *result, snap=self.snap)
+                comparaments.update(result[0])
+                wallvents.update(result[1])
+                self.stats.levels.append((level.id, level.z, len(level.comps_raw), len(level.wallvents_raw),
+                                          len(result[1]), cached))
+
+        ceilvents = {}
+        if any(level.openings_raw for level in levels):
+            with self.stats.phase('openings'):
+                for i, level in enumerate(levels):
+                    ceilvents.update(self.match_openings(level, levels[i - 1] if i else None))
+        self.ceilvents = self.sort_ceilvents(ceilvents)
+
+        with self.stats.phase('sort'):
+            return self.sort_result(comparaments, wallvents)
+
+    '''
+    Сопоставление нескольких этажей
+
+    Двери и помещения разных этажей не взаимодействуют, поэтому при jobs > 1
+    этажи обрабатываются параллельно. Результаты возвращаются в порядке этажей
+    '''
+    def match_levels(self, levels:list) -> list:
+        if self.jobs > 1 and len(levels) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(levels))) as pool:
+                matched = list(pool.map(match_level,
+                                        [level.comps_raw for level in levels],
+                                        [level.wallvents_raw for level in levels],
+                                        repeat(self.use_numpy),
+                                        repeat(self.batch_vents),
+                                        repeat(self.snap)))
+            for _, stats in matched:
+                self.stats.merge(stats)
+            return [result for result, _ in matched]
+        return [self.match(level.comps_raw, level.wallvents_raw) for level in levels]
+
+    '''
+    Сбор этажей документа
+
+    Каждый слой с именем Level* открывает новый этаж, прямоугольники со слоев rooms*, doors* и openings*
+    и окружности (точки привязки) относятся к последнему открытому этажу.
+    Если передан корневой элемент документа, этажи собираются обходом слоев (collect_layers)
+    '''
+    def collect(self, elements, problems:list=None) -> list:
+        if isinstance(elements, inkex.BaseElement):
+            return self.collect_layers(elements, problems)
+
+        levels = []
+        level:CfastLevel = None
 
-    def mapping(self, elements, inkex=None) -> None:
-        def is_visible(elem:ShapeElement) -> bool:
-            style:list = elem.get('style').split(';')
-            for style_attr in style:
-                s = style_attr.split(':')
-                if s[0] == 'stroke' and s[1] == 'none':
-                    return False
-            else:
-                return True
-
-        comps_raw = {}
-        wallvents_raw = {}
-        spots = {}
-        scale:CfastScale = None
-        origin_z = 0.0
-        levels_links = {}
-        num_of_levels = 0
-        
         for elem in elements:
             if isinstance(elem, Layer):
                 if 'level' in elem.label.lower():
-                    origin_z = DEFAULT_HEIGHT_LEVEL * num_of_levels
-                    scale = CfastScale(float(elem.get('cfast:k_width')), float(elem.get('cfast:k_height')))
-                    link_id = elem.get('cfast:link_id')
-                    if link_id is not None:
-                        levels_links[origin_z] = link_id.split(',')
-                    num_of_levels += 1
-            elif isinstance(elem, Rectangle) and is_visible(elem):
-                raw_rect = CfastRectangle(elem, origin_z, scale)
+                    level = CfastLevel.from_layer(elem, DEFAULT_HEIGHT_LEVEL * len(levels), problems)
+                    levels.append(level)
+            elif isinstance(elem, Rectangle) and is_visible(elem.get('style')):
+                raw_rect = CfastRectangle(elem, level.z, level.scale)
                 parent_name = elem.getparent().label.lower()
                 eid = elem.get_id()
                 if 'room' in parent_name:
-                    comps_raw[eid] = raw_rect
+                    level.comps_raw[eid] = raw_rect
                 elif 'door' in parent_name:
-                    wallvents_raw[eid] = raw_rect
+                    level.wallvents_raw[eid] = raw_rect
+                elif 'opening' in parent_name:
+                    level.openings_raw[eid] = raw_rect
             elif isinstance(elem, Circle) or isinstance(elem, Ellipse):
-                spots[elem.get_id()] = {'x':scale.convert_width(elem.center[0]),
-                                        'y':-scale.convert_depth(elem.center[1])}
-        
+                level.add_spot(elem)
+
+        return levels
+
+    '''
+    Сбор этажей обходом слоев документа
+
+    Просматриваются только слои и группы: вне слоев Level* ищутся лишь вложенные слои этажей,
+    поэтому подложки и оформление на отдельных слоях не разбираются. Внутри этажа
+    тип подслоя (rooms*, doors*, openings* или прочий) и масштаб определяются один раз на слой,
+    видимость - один раз на каждое значение style. Прямоугольники вне этих подслоев
+    пропускаются без разбора атрибутов
+    '''
+    def collect_layers(self, root, problems:list=None) -> list:
+        levels = []
+        visible = {}
+        for layer in level_layers(root):
+            level = CfastLevel.from_layer(layer, DEFAULT_HEIGHT_LEVEL * len(levels), problems)
+            levels.append(level)
+            self.collect_level(layer, level, visible)
+        return levels
+
+    '''
+    Сбор прямоугольников и точек привязки одного этажа
+
+    visible - кэш видимости по значению style, общий для этажей документа
+    '''
+    def collect_level(self, layer:Layer, level:CfastLevel, visible:dict=None) -> None:
+        visible = {} if visible is None else visible
 
-        for z in levels_links:
-            bottom_spot_id:str = levels_links[z][0]
-            top_spot_id:str = levels_links[z][1]
-            bottom_spot = spots[bottom_spot_id]
-            top_spot = spots[top_spot_id]
-            d_x:float = bottom_spot['x'] - top_spot['x']
-            d_y:float = bottom_spot['y'] - top_spot['y']
-            spots[top_spot_id] = {'x': top_spot['x'] + d_x, 'y': top_spot['y'] + d_y}
+        def sublayer_rects(level:CfastLevel, group, rects:dict):
+            name = group.label
+            if name is None:
+                return rects
+            name = name.lower()
+            if 'room' in name:
+                return level.comps_raw
+            if 'door' in name:
+                return level.wallvents_raw
+            if 'opening' in name:
+                return level.openings_raw
+            return None
 
-            for comp_rect in list(comps_raw.values()) + list(wallvents_raw.values()):
-                if comp_rect.z0 == z:
-                    comp_rect.set_offset(d_x, d_y)
+        def walk_level(group, level:CfastLevel, rects:dict):
+            for elem in group.iterchildren():
+                if isinstance(elem, Rectangle):
+                    if rects is None: continue
+                    style = elem.get('style')
+                    if style not in visible:
+                        visible[style] = is_visible(style)
+                    if visible[style]:
+                        rects[elem.get_id()] = CfastRectangle(elem, level.z, level.scale)
+                elif isinstance(elem, Circle) or isinstance(elem, Ellipse):
+                    level.add_spot(elem)
+                elif isinstance(elem, Group):
+                    walk_level(elem, level, sublayer_rects(level, elem, rects))
 
+        walk_level(layer, level, None)
 
+    '''
+    Потоковая обработка документа по этажам
+
+    Смещения этажей вычисляются заранее только по точкам привязки. Затем каждый этаж
+    собирается, сопоставляется и передается всем writers (begin, add_level, finish),
+    после чего его прямоугольники освобождаются, поэтому объем памяти определяется
+    самым большим этажом, а не всем зданием. Помещения этажа хранятся до обработки
+    следующего этажа для проемов в его перекрытии. Этажи обрабатываются последовательно, jobs не используется
+    '''
+    def stream(self, root, writers:list, cache=None) -> None:
+        with self.stats.phase('link'):
+            layers = list(level_layers(root))
+            levels = []
+            for layer in layers:
+                level = CfastLevel.from_layer(layer, DEFAULT_HEIGHT_LEVEL * len(levels))
+                for elem in layer.iterdescendants():
+                    if isinstance(elem, Circle) or isinstance(elem, Ellipse):
+                        level.add_spot(elem)
+                levels.append(level)
+            self.link_levels(levels)
+        self.levels = levels
+
+        with self.stats.phase('write'):
+            for writer in writers:
+                writer.begin()
+        visible = {}
+        below = None
+        for layer, level in zip(layers, levels):
+            with self.stats.phase('collect'):
+                self.collect_level(layer, level, visible)
+                if level.link is not None:
+                    d_x, d_y = level.offset
+                    for rect in list(level.comps_raw.values()) + list(level.wallvents_raw.values()) + \
+                                list(level.openings_raw.values()):
+                        rect.set_offset(d_x, d_y)
+                self.registry = CfastIdRegistry.from_levels([level])
+
+            with self.stats.phase('match'):
+                result = cache.lookup(level, self.snap) if cache is not None else None
+                cached = result is not None
+                if not cached:
+                    result = self.match(level.comps_raw, level.wallvents_raw)
+                    if cache is not None:
+                        cache.store(level, *result, snap=self.snap)
+                self.stats.levels.append((level.id, level.z, len(level.comps_raw), len(level.wallvents_raw),
+                                          len(result[1]), cached))
+
+            if level.openings_raw:
+                with self.stats.phase('openings'):
+                    ceilvents = self.sort_ceilvents(self.match_openings(level, below))
+            else:
+                ceilvents = []
+
+            with self.stats.phase('sort'):
+                comps, w_vents = self.sort_result(*result)
+            with self.stats.phase('write'):
+                for writer in writers:
+                    writer.add_level(comps, w_vents, self.registry, ceilvents)
+            if below is not None:
+                below.comps_raw = {}
+            level.wallvents_raw = {}
+            level.openings_raw = {}
+            below = level
+        if below is not None:
+            below.comps_raw = {}
+
+        with self.stats.phase('write'):
+            for writer in writers:
+                writer.finish()
+
+    '''
+    Смещение этажей по точкам привязки
+
+    Смещение этажа - разница координат точки привязки базового этажа (с учетом смещения
+    самого базового этажа) и точки привязки этого этажа. Смещения вычисляются по цепочкам
+    привязок от неподвижных этажей, поэтому цепочки любой длины не зависят от порядка
+    этажей в документе, а каждый прямоугольник смещается ровно один раз
+    '''
+    def link_levels(self, levels:list) -> None:
+        spot_levels = {}
+        for level in levels:
+            for spot_id in level.spots:
+                spot_levels[spot_id] = level
+
+        def base_level(level:CfastLevel) -> CfastLevel:
+            for spot_id in level.link[:2]:
+                if spot_id not in spot_levels:
+                    raise inkex.AbortExtension('Точка привязки {} этажа {} не найдена'.format(spot_id, level.id))
+            return spot_levels[level.link[0]]
+
+        resolved = {}
+        for level in levels:
+            # Подъем по цепочке привязок до этажа с известным смещением
+            chain = []
+            current = level
+            while id(current) not in resolved:
+                if current.link is None:
+                    resolved[id(current)] = False
+                    break
+                if current in chain:
+                    raise inkex.AbortExtension('Циклическая привязка этажей: {}'.format(
+                                               ' -> '.join(l.id for l in chain + [current])))
+                chain.append(current)
+                current = base_level(current)
+
+            # Вычисление смещений в обратном порядке: от базового этажа к привязанному
+            for linked in reversed(chain):
+                base = base_level(linked)
+                bottom_spot = base.spots[linked.link[0]]
+                top_spot = linked.spots[linked.link[1]]
+                d_x:float = (bottom_spot['x'] + base.offset[0]) - top_spot['x']
+                d_y:float = (bottom_spot['y'] + base.offset[1]) - top_spot['y']
+                linked.offset = (d_x, d_y)
+                resolved[id(linked)] = True
+
+        for level in levels:
+            if not resolved[id(level)]: continue
+            d_x, d_y = level.offset
+            for comp_rect in list(level.comps_raw.values()) + list(level.wallvents_raw.values()) + \
+                             list(level.openings_raw.values()):
+                comp_rect.set_offset(d_x, d_y)
+
+    '''
+    Сопоставление помещений и дверей
+
+    Возвращает словари помещений и проемов по id в порядке их появления
+    '''
+    def match(self, comps_raw:dict, wallvents_raw:dict) -> tuple:
         comparaments = {}
-        wallvents = {}
         for comp_rect_id in comps_raw: # Обход по всем прямоугольникам типа Помещение
             comp_rect:CfastRectangle = comps_raw.get(comp_rect_id)
             comparaments[comp_rect_id] = CfastComparament(id=comp_rect_id, \
                                                         depth=comp_rect.height, height=DEFAULT_HEIGHT_LEVEL, width=comp_rect.width, \
                                                         origin=comp_rect.p0)
-            for vent_rect_id in wallvents_raw: # Обход каждого прямоугольника типа Дверь
-                wallvent_rect:CfastRectangle = wallvents_raw.get(vent_rect_id)
-                # Если дверь и помещение на разных уровнях, то их отношение не рассматривается
-                if comp_rect.p0.z != wallvent_rect.p0.z: continue
-                
-                for wallvent_point in wallvent_rect.get_polygon(): # Обход каждой точки двери
-                    # Далее ищем какая дверь, какие помещения соединяет
-                    # Заодно формируем информацию по двери
-                    if self.point_in_ractangle(wallvent_point, comp_rect.get_polygon()):
-                        if vent_rect_id not in wallvents:
-                            wallvents[vent_rect_id] = CfastWallVent(vent_rect_id, [comp_rect_id], 0.0, 1.0)
-                        else:
-                            wallvent:CfastWallVent = wallvents.get(vent_rect_id)
-                            if comp_rect_id not in wallvent.comp_ids:
-                                wallvent.comp_ids.append(comp_rect_id)
-                            wallvent.comp_ids.sort(key = lambda id: int(id[4:]) if '-' not in id else int(id[4:].replace('-', '')) )
-                            
-                            if wallvent.face is None or len(wallvent.comp_ids) == 2:
-                                wallvent_additional = self.process_wallvent(wallvents_raw.get(vent_rect_id), comps_raw.get(wallvent.comp_ids[0]).get_segments())
-                                wallvent.face = wallvent_additional['face']
-                                wallvent.width = wallvent_additional['width']
-                                wallvent.offset = wallvent_additional['offset']
-        
+
+        wallvents = {}
+        contacts = self.contacts_numpy if self.use_numpy else self.contacts
+        registry = self.registry if self.registry is not None else CfastIdRegistry.from_ids(comps_raw)
+        comp_key = registry.keys.__getitem__
+        # Помещение, относительно которого определяются сторона, ширина и смещение двери
+        targets = {}
+        # Каждое попадание угла двери в помещение. Далее ищем какая дверь, какие помещения соединяет
+        # Заодно формируем информацию по двери
+        for comp_rect_id, vent_rect_id in contacts(comps_raw, wallvents_raw):
+            if vent_rect_id not in wallvents:
+                wallvents[vent_rect_id] = CfastWallVent(vent_rect_id, [comp_rect_id], 0.0, 1.0)
+            else:
+                wallvent:CfastWallVent = wallvents.get(vent_rect_id)
+                if comp_rect_id not in wallvent.comp_ids:
+                    wallvent.comp_ids.append(comp_rect_id)
+                wallvent.comp_ids.sort(key=comp_key)
+
+                if vent_rect_id not in targets or len(wallvent.comp_ids) == 2:
+                    if self.batch_vents:
+                        targets[vent_rect_id] = wallvent.comp_ids[0]
+                        continue
+                    t = time.perf_counter()
+                    wallvent_additional = self.process_wallvent(wallvents_raw.get(vent_rect_id), comps_raw.get(wallvent.comp_ids[0]).get_segments())
+                    self.stats.add_time('vents', time.perf_counter() - t)
+                    targets[vent_rect_id] = wallvent.comp_ids[0]
+                    wallvent.face = wallvent_additional['face']
+                    wallvent.width = wallvent_additional['width']
+                    wallvent.offset = wallvent_additional['offset']
+
+        if self.batch_vents:
+            t = time.perf_counter()
+            self.resolve_wallvents(wallvents, targets, comps_raw, wallvents_raw)
+            self.stats.add_time('vents', time.perf_counter() - t)
+
+        return comparaments, wallvents
+
+    '''
+    Сторона, ширина и смещение всех дверей этажа за один проход
+
+    targets - id двери -> id помещения, относительно которого вычисляется дверь.
+    Это помещение, которое последним передал бы в process_wallvent обход касаний в match,
+    поэтому результат совпадает с обработкой двери при каждом касании
+    '''
+    def resolve_wallvents(self, wallvents:dict, targets:dict, comps_raw:dict, wallvents_raw:dict) -> None:
+        for vent_rect_id, comp_rect_id in targets.items():
+            wallvent_raw = wallvents_raw[vent_rect_id]
+            comp_rect = comps_raw[comp_rect_id]
+            geometry = self.wallvent_geometry(wallvent_raw, comp_rect)
+            if geometry is None:
+                wallvent_additional = self.process_wallvent(wallvent_raw, comp_rect.get_segments())
+                geometry = (wallvent_additional['face'], wallvent_additional['width'], wallvent_additional['offset'])
+            wallvent = wallvents[vent_rect_id]
+            wallvent.face, wallvent.width, wallvent.offset = geometry
+
+    '''
+    Сторона, ширина и смещение двери по границам прямоугольников
+
+    Стороны прямоугольников параллельны осям, поэтому сторона двери и помещения касаются
+    тогда и только тогда, когда касаются их габариты. Габариты сравниваются в целых
+    миллиметрах с допуском snap (cfast_fixed.wallvent_side) в порядке get_segments,
+    как и в process_wallvent. Для вырожденных прямоугольников и дверей, не касающихся
+    сторон помещения, возвращает None
+    '''
+    def wallvent_geometry(self, wallvent_raw:CfastRectangle, comp_rect:CfastRectangle):
+        side = cfast_fixed.wallvent_side(wallvent_raw.box, comp_rect.box, self.snap)
+        if side is None:
+            return None
+        j, width, offset = side
+        return self.COMP_FACES[j], to_metres(width), to_metres(offset)
+
+    def sort_result(self, comparaments:dict, wallvents:dict) -> tuple:
         # Сортировка элементов по возрастанию индекса
         # Без сортировкаи  CFAST говорит об ошибке, потому что, например, 
         # дверь может соединять только помещение с меньшим индесом с помещеним с большим индексом,
         # а за индекс принимается номер элемента в списке, а не id
         # Сортировка выполняется по каждому этажу
-        item_id:int = lambda item: (item.origin[2] if hasattr(item, 'origin') else 0,
-                                    int(item.id[4:]) if '-' not in item.id else int(item.id[4:].replace('-', '')))
+        registry = self.registry
+        if registry is None:
+            registry = CfastIdRegistry.from_ids(list(comparaments) + list(wallvents))
+        keys = registry.keys
 
-        comps   = sorted(list(comparaments.values()), key=item_id)
-        w_vents = sorted(list(wallvents.values()),    key=item_id)
+        comps   = sorted(comparaments.values(), key=lambda comp: (comp.origin[2], keys[comp.id]))
+        w_vents = sorted(wallvents.values(),    key=lambda wallvent: keys[wallvent.id])
 
         return comps, w_vents
 
+    '''
+    Сопоставление геометрии с упаковкой результата для экспорта в несколько форматов
+    '''
+    def building(self, elements, name:str='', cache=None) -> CfastBuilding:
+        comps, w_vents = self.mapping(elements, cache=cache)
+        levels = [(level.id, level.z, level.scale.k_width, level.scale.k_height) + tuple(level.offset)
+                  for level in self.levels]
+        return CfastBuilding(comps, w_vents, name, levels, self.ceilvents)
+
+    '''
+    Проемы в перекрытии этажа level
+
+    Проем соединяет помещение этажа level, с которым он пересекается по наибольшей площади,
+    и такое же помещение нижнего этажа below. Если такого помещения нет, с этой стороны
+    проема находится OUTSIDE, проемы без помещений с обеих сторон пропускаются.
+    Пересечения ищутся проходом по оси X (overlap_pairs), а не перебором всех пар
+    '''
+    def match_openings(self, level:CfastLevel, below:CfastLevel=None) -> dict:
+        if not level.openings_raw:
+            return {}
+        best = {}
+        for side, comps_raw in enumerate((level.comps_raw, below.comps_raw if below is not None else {})):
+            for opening_id, comp_id, area in overlap_pairs(level.openings_raw, comps_raw, self.snap):
+                if area > best.get((opening_id, side), (0.0,))[0]:
+                    best[(opening_id, side)] = (area, comp_id)
+
+        ceilvents = {}
+        for opening_id, opening in level.openings_raw.items():
+            top = best.get((opening_id, 0))
+            bottom = best.get((opening_id, 1))
+            if top is None and bottom is None:
+                continue
+            origin = level.comps_raw[top[1]] if top is not None else below.comps_raw[bottom[1]]
+            offsets = (round(opening.x0 + opening.width / 2 - origin.x0, 4),
+                       round(opening.y0 + opening.height / 2 - origin.y0, 4))
+            ceilvents[opening_id] = CfastCeilingVent(opening_id,
+                                                     [top[1] if top is not None else None,
+                                                      bottom[1] if bottom is not None else None],
+                                                     round(opening.width * opening.height, 4), offsets)
+        return ceilvents
+
+    def sort_ceilvents(self, ceilvents:dict) -> list:
+        keys = self.registry.keys
+        return sorted(ceilvents.values(), key=lambda ceilvent: keys[ceilvent.id])
+
+    '''
+    Построение пространственного индекса дверей для каждого уровня
+
+    Размер ячейки сетки выбирается равным среднему размеру помещения уровня,
+    поэтому каждое помещение перекрывает лишь несколько ячеек, а каждая ячейка
+    содержит двери только соседних помещений.
+    '''
+    def index_wallvents(self, comps_raw:dict, wallvents_raw:dict) -> dict:
+        sizes = {}
+        for comp_rect in comps_raw.values():
+            z = to_units(comp_rect.z0)
+            total, count = sizes.get(z, (0.0, 0))
+            sizes[z] = (total + max(comp_rect.width, comp_rect.height), count + 1)
+
+        index = {}
+        for vent_rect_id, wallvent_rect in wallvents_raw.items():
+            z = to_units(wallvent_rect.z0)
+            if z not in index:
+                total, count = sizes.get(z, (0.0, 0))
+                index[z] = CfastGridIndex(total / count if count else 0.0)
+            index[z].insert(vent_rect_id, wallvent_rect)
+        return index
+
+    '''
+    Поиск касаний дверей и помещений
+
+    Для каждого угла двери, который попадает в помещение того же уровня, возвращается
+    пара (id помещения, id двери). Порядок пар совпадает с порядком полного перебора:
+    помещения, затем двери в порядке их следования в документе, затем углы двери.
+    Попадание проверяется в целых миллиметрах с допуском snap (cfast_fixed.contains)
+    '''
+    def contacts(self, comps_raw:dict, wallvents_raw:dict):
+        wallvents_index = self.index_wallvents(comps_raw, wallvents_raw)
+        snap = self.snap
+        margin = to_metres(snap)
+        contains = cfast_fixed.contains
+        for comp_rect_id, comp_rect in comps_raw.items():
+            level_index:CfastGridIndex = wallvents_index.get(to_units(comp_rect.z0))
+            if level_index is None: continue
+            comp_box = comp_rect.box
+            # Обход только тех дверей, габарит которых перекрывает помещение
+            for vent_rect_id in level_index.query(comp_rect, margin):
+                for x, y in cfast_fixed.corners(wallvents_raw[vent_rect_id].box): # Обход каждой точки двери
+                    self.stats.point_tests += 1
+                    if contains(comp_box, x, y, snap):
+                        yield comp_rect_id, vent_rect_id
+
+    '''
+    Поиск касаний дверей и помещений с помощью NumPy
+
+    Габариты помещений и углы дверей уровня в целых миллиметрах упаковываются в массивы,
+    а проверка cfast_fixed.contains выполняется для всех пар сразу, поэтому результат
+    совпадает с contacts. Помещения обрабатываются блоками, упорядоченными по x0,
+    и каждый блок сравнивается только с углами из его полосы по оси X.
+    '''
+    def contacts_numpy(self, comps_raw:dict, wallvents_raw:dict):
+        comp_ids = list(comps_raw)
+        vent_ids = list(wallvents_raw)
+        levels = {}
+        for i, comp_rect_id in enumerate(comp_ids):
+            levels.setdefault(to_units(comps_raw[comp_rect_id].z0), ([], []))[0].append(i)
+        for i, vent_rect_id in enumerate(vent_ids):
+            level = levels.get(to_units(wallvents_raw[vent_rect_id].z0))
+            if level is not None:
+                level[1].append(i)
+
+        # Ключ касания: (номер помещения, номер двери, номер угла), упакованный в одно число
+        num_of_corners = 4 * len(vent_ids)
+        keys = []
+        for comps_order, vents_order in levels.values():
+            if not vents_order: continue
+            corners = numpy.array([(4 * i + k, x, y)
+                                   for i in vents_order
+                                   for k, (x, y) in enumerate(cfast_fixed.corners(wallvents_raw[vent_ids[i]].box))],
+                                  dtype=numpy.int64)
+            corners = corners[numpy.argsort(corners[:, 1], kind='stable')]
+            corner_key = corners[:, 0]
+            px, py = corners[:, 1], corners[:, 2]
+
+            rooms = numpy.array([(i,) + comps_raw[comp_ids[i]].box for i in comps_order], dtype=numpy.int64)
+            rooms = rooms[numpy.argsort(rooms[:, 1], kind='stable')]
+
+            chunk = max(1, self.NUMPY_CHUNK // len(px))
+            for start in range(0, len(rooms), chunk):
+                block = rooms[start:start + chunk]
+                x_min = block[:, 1].min() - self.snap
+                x_max = block[:, 3].max() + self.snap
+                lo = numpy.searchsorted(px, x_min, side='left')
+                hi = numpy.searchsorted(px, x_max, side='right')
+                if lo >= hi: continue
+
+                inside = self.points_in_boxes(block[:, 1:5], px[lo:hi], py[lo:hi], self.snap)
+                self.stats.point_tests += inside.size
+                r, c = numpy.nonzero(inside)
+                keys.append(block[r, 0] * num_of_corners + corner_key[lo:hi][c])
+
+        if not keys:
+            return
+        for key in numpy.sort(numpy.concatenate(keys)).tolist():
+            yield comp_ids[key // num_of_corners], vent_ids[key % num_of_corners // 4]
+
+    '''
+    Векторная версия cfast_fixed.contains
+
+    boxes - массив (N, 4) габаритов помещений (x0, y0, x1, y1) в миллиметрах,
+    px, py - массивы (M,) координат точек. Возвращает матрицу (N, M) попаданий.
+    '''
+    @staticmethod
+    def points_in_boxes(boxes, px, py, snap:int=cfast_fixed.DEFAULT_SNAP):
+        x0, y0, x1, y1 = (boxes[:, [k]] for k in range(4))
+        return (px >= x0 - snap) & (px <= x1 + snap) & (py >= y0 - snap) & (py <= y1 + snap)
+
     '''
     Проверка вхождения точки в прямоугольник
 
@@ -284,8 +1271,11 @@ class CfastProcessing:
     потому что нам известно, что каждое помещение представляет прямоугольником.
     После получения треугольников поподает ли точка в треугольник, для чего выполняется проверка 
     с какой стороны от стороны треугольника находится точка.
+    Экспорт использует целочисленную проверку cfast_fixed.contains, эта проверка
+    остается эталонной для полного перебора в cfast_benchmark.
     '''
     def point_in_ractangle(self, point:CfastPoint, polygon:CfastPolygon) -> bool:
+        self.stats.point_tests += 1
         triangles = ((polygon[0], polygon[1], polygon[2]), (polygon[2], polygon[3], polygon[0]))
 
         '''
@@ -321,6 +1311,7 @@ class CfastProcessing:
     Проверка на пересечение двух линий
     '''
     def intersect(self, l1:Segment, l2:Segment) -> bool:
+        self.stats.intersect_tests += 1
         def area(a:CfastPoint, b:CfastPoint, c:CfastPoint) -> float:
             return (b.x - a.x) * (c.y - a.y) - (b.y - a.y) * (c.x - a.x)
         
@@ -359,10 +1350,11 @@ class CfastProcessing:
                 if b: break
             return s_wv, ss_wv[(i+2)%4], s_c
         
+        # Координаты концов сравниваются в целых миллиметрах
         def get_orientation_segment(segment:Segment) -> int:
-            if segment.p1.x == segment.p2.x:
+            if to_units(segment.p1.x) == to_units(segment.p2.x):
                 return Segment.VERTICAL
-            elif segment.p1.y == segment.p2.y:
+            elif to_units(segment.p1.y) == to_units(segment.p2.y):
                 return Segment.HORISONTAL
         
         s1, s2, s3 = get_crosses_segments(wallvent_raw.get_segments(), comp_segments)
@@ -398,26 +1390,163 @@ class CfastProcessing:
         
         return {'face':face, 'width':round(wallvent_width, 3), 'offset':round(vent_offset, 3)}
 
-class ExportCfastGeometry(inkex.OutputExtension):
-    select_all = (ShapeElement,)
+'''
+Сопоставление одного этажа в процессе обработчика
+'''
+def match_level(comps_raw:dict, wallvents_raw:dict, use_numpy:bool, batch_vents:bool=True,
+                snap:int=cfast_fixed.DEFAULT_SNAP) -> tuple:
+    processing = CfastProcessing(use_numpy, batch_vents=batch_vents, snap=snap)
+    return processing.match(comps_raw, wallvents_raw), processing.stats
+
+'''
+Профилирование блока кода через cProfile с сохранением профиля в файл path
+Без path профилирование не выполняется
+'''
+@contextmanager
+def profiled(path:str=None):
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+'''
+Вывод статистики экспорта и начала сформированного файла в окно сообщений расширения
+'''
+def msg_report(ext, stats:CfastStats, lines) -> None:
+    for line in stats.report():
+        ext.msg(line)
+    ext.msg('---------------------------------')
+    preview = list(islice(lines, PREVIEW_LINES + 1))
+    for line in preview[:PREVIEW_LINES]:
+        ext.msg(line)
+    if len(preview) > PREVIEW_LINES:
+        ext.msg('...')
+
+'''
+Количество процессов для обработки этажей из переменной окружения CFAST_JOBS
+'''
+def jobs_from_env() -> int:
+    try:
+        return int(os.environ.get(JOBS_ENV, 1))
+    except ValueError:
+        return 1
+
+class CfastExportSummary:
+    '''
+    Итог сохранения в расширении для сообщения о результате
+
+    notes - строки после количества элементов (файлы, части здания, предупреждения)
+    preview - строки файла для просмотра в окне сообщений, None - без просмотра
+    '''
+    def __init__(self, comps:int, vents:int, ceilvents:int=0, levels:int=None, notes:list=(), preview=None):
+        self.comps = comps
+        self.vents = vents
+        self.ceilvents = ceilvents
+        self.levels = levels
+        self.notes = notes
+        self.preview = preview
+
+    @classmethod
+    def of_building(cls, building:CfastBuilding, **kwargs):
+        return cls(len(building.comparaments), len(building.wallvents), len(building.ceilvents), **kwargs)
 
+class CfastExtensionExport:
+    '''
+    Общая часть сохранения здания в расширениях экспорта
+
+    Кэш этажей расширения (или демона), обработка этажей с полной проверкой чертежа
+    при ошибке и сообщение о результате. Расширение только записывает файлы
+    '''
+    def __init__(self, ext):
+        from cfast_mapping_cache import extension_cache
+        self.ext = ext
+        self.cache = extension_cache(ext)
+        self.processing = CfastProcessing(jobs=jobs_from_env())
+
+    def building(self, default_name:str='building.svg') -> CfastBuilding:
+        from cfast_validation import validated
+        with validated(self.ext.svg, self.ext.msg):
+            return self.processing.building(self.ext.svg, self.ext.svg.name or default_name, self.cache)
+
+    def stream(self, writers:list) -> None:
+        from cfast_validation import validated
+        with validated(self.ext.svg, self.ext.msg):
+            self.processing.stream(self.ext.svg, writers, self.cache)
+
+    def phase(self, name:str='write'):
+        return self.processing.stats.phase(name)
+
+    def report(self, summary:CfastExportSummary) -> None:
+        msg = self.ext.msg
+        msg('Экспорт данных успешно произведен')
+        msg('=================================')
+        if summary.levels is not None:
+            msg('Количество этажей: {}'.format(summary.levels))
+        msg('Количество помещений: {}'.format(summary.comps))
+        msg('Количество проемов: {}'.format(summary.vents))
+        if summary.ceilvents:
+            msg('Количество проемов в перекрытиях: {}'.format(summary.ceilvents))
+        if self.cache is not None:
+            msg('Этажей из кэша: {} из {}'.format(self.cache.hits, self.cache.hits + self.cache.misses))
+        for line in summary.notes:
+            msg(line)
+        msg('---------------------------------')
+        if summary.preview is None:
+            for line in self.processing.stats.report():
+                msg(line)
+        else:
+            msg_report(self.ext, self.processing.stats, summary.preview)
+
+'''
+Сохранение в расширении экспорта: save(export) записывает файлы и возвращает CfastExportSummary
+
+Профилирование (CFAST_PROFILE), сохранение кэша и сообщение о результате общие для всех расширений
+'''
+def export_extension(ext, save) -> None:
+    from cfast_mapping_cache import save_cache
+    with profiled(os.environ.get(PROFILE_ENV)):
+        export = CfastExtensionExport(ext)
+        summary = save(export)
+        save_cache(export.cache, ext.msg)
+    export.report(summary)
+
+class ExportCfastGeometry(inkex.OutputExtension):
     def save(self, stream):
-        comps, w_vents = CfastProcessing().mapping(self.svg.selection.filter(ShapeElement).values(), self)
-        cfast_content = CfastFile(comps, w_vents).to_string()
-        stream.write("{}\n".format(cfast_content).encode('utf-8'))
-
-        self.msg('Экспорт данных успешно произведен')
-        self.msg('=================================')
-        self.msg('Количество помещений: {}'.format(len(comps)))
-        self.msg('Количество проемов: {}'.format(len(w_vents)))
-        if len(w_vents) > 100:
-            self.msg('---------------------------------')
-            self.msg('Внимание! Ваше здание содержит более 100 помещений.')
-            self.msg('CFAST не работает с таким количеством помещений.')
-            self.msg('Для просмотра здания, сохраните файл в формате \'smv\'')
-        self.msg('---------------------------------')
-        self.msg(cfast_content)
-    
+        export_extension(self, lambda export: self.save_building(export, stream))
+
+    def save_building(self, export:CfastExtensionExport, stream) -> CfastExportSummary:
+        if os.environ.get(STREAM_ENV) == '1':
+            cfast_file = CfastStreamFile(stream)
+            export.stream([cfast_file])
+            summary = CfastExportSummary(cfast_file.comparaments, cfast_file.wallvents, cfast_file.ceilvents,
+                                         preview=cfast_file.preview)
+        else:
+            building = export.building()
+            cfast_file = CfastFile(building.comparaments, building.wallvents, ceilvents=building.ceilvents)
+            with export.phase():
+                cfast_file.write_to(stream)
+            summary = CfastExportSummary.of_building(building, preview=cfast_file.lines())
+
+        notes = []
+        if summary.comps > MAX_COMPARAMENTS:
+            notes.append('---------------------------------')
+            notes.append('Внимание! Ваше здание содержит более {} помещений.'.format(MAX_COMPARAMENTS))
+            notes.append('CFAST не работает с таким количеством помещений.')
+            notes.append('Для просмотра здания, сохраните файл в формате \'smv\'')
+            notes.append('Для расчета сохраните здание по частям в формате \'CFAST geometry split into sub-models (*.zip)\'')
+        if summary.vents > MAX_WALLVENTS:
+            notes.append('---------------------------------')
+            notes.append('Внимание! Ваше здание содержит более {} проемов.'.format(MAX_WALLVENTS))
+            notes.append('Расчет CFAST с таким количеством проемов может занять много времени.')
+        summary.notes = notes
+        return summary
+
 
 if __name__ == '__main__':
     ExportCfastGeometry().run()
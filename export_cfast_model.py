@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export the mapped building model (.cfastmodel)
+"""
+
+import inkex
+from export_cfast_geometry import CfastExtensionExport, CfastExportSummary, export_extension
+from cfast_model import write_model
+
+class ExportCfastModel(inkex.OutputExtension):
+    def save(self, stream):
+        export_extension(self, lambda export: self.save_building(export, stream))
+
+    def save_building(self, export:CfastExtensionExport, stream) -> CfastExportSummary:
+        building = export.building()
+        with export.phase():
+            write_model(stream, building)
+        return CfastExportSummary.of_building(building, levels=len(building.levels))
+
+if __name__ == '__main__':
+    ExportCfastModel().run()
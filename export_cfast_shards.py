@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export a large building as several CFAST sub-models (.zip)
+"""
+
+import json
+import math
+import os
+import zipfile
+
+import inkex
+from export_cfast_geometry import CfastBuilding, CfastFile, CfastWallVent, CfastCeilingVent, CfastFace, \
+                                  CfastExtensionExport, CfastExportSummary, export_extension, MAX_COMPARAMENTS
+
+MANIFEST = 'manifest.json'
+
+OPPOSITE_FACE = {CfastFace.FRONT: CfastFace.REAR, CfastFace.REAR: CfastFace.FRONT,
+                 CfastFace.LEFT: CfastFace.RIGHT, CfastFace.RIGHT: CfastFace.LEFT}
+
+class CfastShard:
+    '''
+    Часть здания для отдельного расчета CFAST
+
+    boundary - разрезанные проемы: (проем, помещение этой части, соседнее помещение)
+    '''
+    def __init__(self, comparaments:list, wallvents:list, boundary:list, ceilvents:list=None):
+        self.comparaments = comparaments
+        self.wallvents = wallvents
+        self.boundary = boundary
+        self.ceilvents = ceilvents or []
+
+    def levels(self) -> list:
+        return sorted({comp.origin[2] for comp in self.comparaments})
+
+'''
+Разбиение помещений одного этажа на части не больше limit помещений
+
+Части наращиваются жадно от угла этажа: следующим в часть добавляется помещение,
+у которого больше всего проемов в уже набранную часть и меньше всего - в остальные
+нераспределенные помещения. Так граница части проходит через минимум проемов
+'''
+def split_level(comps:list, edges:dict, limit:int) -> list:
+    parts_count = int(math.ceil(len(comps) / limit))
+    if parts_count <= 1:
+        return [comps]
+    part_size = int(math.ceil(len(comps) / parts_count))
+
+    order = {comp.id: i for i, comp in enumerate(comps)}
+    free = {comp.id: comp for comp in comps}
+    parts = []
+    while free:
+        part = []
+        gain = {}
+        while free and len(part) < part_size:
+            if gain:
+                comp_id = max(gain, key=lambda c: (gain[c], -order[c]))
+            else:
+                comp_id = min(free, key=lambda c: (free[c].origin[0] + free[c].origin[1], order[c]))
+            gain.pop(comp_id, None)
+            part.append(free.pop(comp_id))
+            for neighbour, weight in edges.get(comp_id, {}).items():
+                if neighbour in free:
+                    gain[neighbour] = gain.get(neighbour, -sum(w for n, w in edges[neighbour].items() if n in free or n == comp_id)) \
+                                      + 2 * weight
+        parts.append(sorted(part, key=lambda comp: order[comp.id]))
+    return parts
+
+'''
+Группы помещений для частей здания
+
+Проемы соединяют только помещения одного этажа, поэтому этажи целиком
+объединяются в части без разрезания проемов. Разрезается только этаж,
+который сам не помещается в одну часть
+'''
+def partition(building:CfastBuilding, limit:int=MAX_COMPARAMENTS) -> list:
+    levels = {}
+    for comp in building.comparaments:
+        levels.setdefault(comp.origin[2], []).append(comp)
+
+    edges = {}
+    for wallvent in building.wallvents:
+        if len(wallvent.comp_ids) != 2: continue
+        a, b = wallvent.comp_ids
+        edges.setdefault(a, {})[b] = edges.get(a, {}).get(b, 0) + 1
+        edges.setdefault(b, {})[a] = edges.get(b, {}).get(a, 0) + 1
+
+    groups = []
+    current = []
+    for z in sorted(levels):
+        level_comps = levels[z]
+        if len(level_comps) > limit:
+            if current:
+                groups.append(current)
+                current = []
+            groups.extend(split_level(level_comps, edges, limit))
+        elif len(current) + len(level_comps) > limit:
+            groups.append(current)
+            current = list(level_comps)
+        else:
+            current.extend(level_comps)
+    if current:
+        groups.append(current)
+    return groups
+
+'''
+Проем разрезанной границы как проем наружу из помещения comp
+
+Грань и смещение проема вычисляются относительно первого помещения, поэтому
+для второго помещения грань заменяется противоположной, а смещение пересчитывается
+от его угла
+'''
+def outside_vent(wallvent:CfastWallVent, comp_id:str, comps_index:dict) -> CfastWallVent:
+    vent = CfastWallVent(wallvent.id, [comp_id], wallvent.offset, wallvent.width, wallvent.top, wallvent.bottom)
+    vent.type = wallvent.type
+    vent.face = wallvent.face
+    if comp_id == wallvent.comp_ids[0]:
+        return vent
+
+    base = comps_index[wallvent.comp_ids[0]][1]
+    comp = comps_index[comp_id][1]
+    face = wallvent.face
+    if face == CfastFace.FRONT:
+        vent_max = base.origin[0] + wallvent.offset + wallvent.width
+        offset = comp.origin[0] + comp.width - vent_max
+    elif face == CfastFace.REAR:
+        vent_min = base.origin[0] + base.width - wallvent.offset - wallvent.width
+        offset = vent_min - comp.origin[0]
+    elif face == CfastFace.RIGHT:
+        vent_max = base.origin[1] + wallvent.offset + wallvent.width
+        offset = comp.origin[1] + comp.depth - vent_max
+    else:
+        vent_min = base.origin[1] + base.depth - wallvent.offset - wallvent.width
+        offset = vent_min - comp.origin[1]
+    vent.face = OPPOSITE_FACE[face]
+    vent.offset = round(offset, 3)
+    return vent
+
+'''
+Проем в перекрытии разрезанной границы как проем наружу из помещения comp
+
+Центр проема отсчитывается от верхнего помещения, поэтому если в части
+осталось только нижнее помещение, центр пересчитывается от его угла
+'''
+def outside_ceilvent(ceilvent:CfastCeilingVent, comp_id:str, comps_index:dict) -> CfastCeilingVent:
+    top, bottom = ceilvent.comp_ids
+    if comp_id == top:
+        return CfastCeilingVent(ceilvent.id, [top, None], ceilvent.area, ceilvent.offsets)
+    base = comps_index[top][1]
+    comp = comps_index[comp_id][1]
+    offsets = (round(base.origin[0] + ceilvent.offsets[0] - comp.origin[0], 4),
+               round(base.origin[1] + ceilvent.offsets[1] - comp.origin[1], 4))
+    return CfastCeilingVent(ceilvent.id, [None, bottom], ceilvent.area, offsets)
+
+'''
+Разбиение здания на части, каждая из которых - самостоятельная модель CFAST
+'''
+def shard_building(building:CfastBuilding, limit:int=MAX_COMPARAMENTS) -> list:
+    groups = partition(building, limit)
+    shard_of = {comp.id: i for i, group in enumerate(groups) for comp in group}
+    comps_index = building.comps_index()
+
+    # Порядок помещений и проемов в части совпадает с порядком в полном здании
+    shards = []
+    for i, group in enumerate(groups):
+        members = {comp.id for comp in group}
+        wallvents = []
+        boundary = []
+        for wallvent in building.wallvents:
+            inside = [comp_id for comp_id in wallvent.comp_ids if comp_id in members]
+            if not inside: continue
+            if len(inside) == len(wallvent.comp_ids):
+                wallvents.append(wallvent)
+                continue
+            comp_id = inside[0]
+            neighbour = [c for c in wallvent.comp_ids if c != comp_id][0]
+            wallvents.append(outside_vent(wallvent, comp_id, comps_index))
+            boundary.append((wallvent.id, comp_id, neighbour, shard_of[neighbour]))
+        ceilvents = []
+        for ceilvent in building.ceilvents:
+            inside = [comp_id for comp_id in ceilvent.comp_ids if comp_id in members]
+            if not inside: continue
+            neighbour = [c for c in ceilvent.comp_ids if c is not None and c not in members]
+            if not neighbour:
+                ceilvents.append(ceilvent)
+                continue
+            ceilvents.append(outside_ceilvent(ceilvent, inside[0], comps_index))
+            boundary.append((ceilvent.id, inside[0], neighbour[0], shard_of[neighbour[0]]))
+        comparaments = [comp for comp in building.comparaments if comp.id in members]
+        shards.append(CfastShard(comparaments, wallvents, boundary, ceilvents))
+    return shards
+
+'''
+Запись частей здания и описания границ (manifest.json) в zip-архив
+'''
+def write_shards(stream, building:CfastBuilding, limit:int=MAX_COMPARAMENTS) -> list:
+    stem = os.path.splitext(building.name)[0] or 'building'
+    shards = shard_building(building, limit)
+    names = ['{}_{:02d}.in'.format(stem, i + 1) for i in range(len(shards))]
+
+    manifest = {'name': building.name, 'limit': limit, 'shards': []}
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, shard in zip(names, shards):
+            with bundle.open(name, 'w') as entry:
+                CfastFile(shard.comparaments, shard.wallvents, ceilvents=shard.ceilvents).write_to(entry)
+            manifest['shards'].append({
+                'file': name,
+                'levels': shard.levels(),
+                'comparaments': [comp.id for comp in shard.comparaments],
+                'wallvents': len(shard.wallvents),
+                'boundary': [{'vent': vent_id, 'comp': comp_id, 'neighbour': neighbour, 'neighbour_file': names[j]}
+                             for vent_id, comp_id, neighbour, j in shard.boundary],
+            })
+        bundle.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest['shards']
+
+class ExportCfastShards(inkex.OutputExtension):
+    def add_arguments(self, pars):
+        pars.add_argument("--max_comps", type=int, dest="max_comps", default=MAX_COMPARAMENTS)
+
+    def save(self, stream):
+        export_extension(self, lambda export: self.save_building(export, stream))
+
+    def save_building(self, export:CfastExtensionExport, stream) -> CfastExportSummary:
+        limit = max(1, self.options.max_comps)
+        building = export.building()
+        with export.phase():
+            shards = write_shards(stream, building, limit)
+        notes = ['Количество частей: {} (не более {} помещений)'.format(len(shards), limit)]
+        notes.extend('{}: помещений {}, разрезанных проемов {}'.format(
+                     shard['file'], len(shard['comparaments']), len(shard['boundary'])) for shard in shards)
+        return CfastExportSummary.of_building(building, notes=notes)
+
+if __name__ == '__main__':
+    ExportCfastShards().run()
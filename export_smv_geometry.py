@@ -19,9 +19,11 @@
 Export a Smokeview geometry file (.smv)
 """
 
+import os
+
 import inkex
-from inkex import ShapeElement
-from export_cfast_geometry import CfastFace, CfastProcessing, CfastComparament, CfastPoint
+from export_cfast_geometry import CfastFace, CfastComparament, CfastPoint, CfastSpool, write_lines, \
+                                  CfastExtensionExport, CfastExportSummary, export_extension, STREAM_ENV
 
 LR = '\n'
 
@@ -29,28 +31,47 @@ class SmvFile():
     ZONE = "ZONE \n {}\n PRESSURE\n P\n Pa\n Layer Height\n zlay\n m\n TEMPERATURE\n TEMP\n C\n TEMPERATURE\n TEMP\n C"
     ROOM = "ROOM"
     HVENTPOS = "HVENTPOS"
+    HVENT = '  {}  {}  {}  {}  {}  {}  {}  {}'
+    VVENTPOS = "VVENTPOS"
+    # Квадратный проем
+    VVENT = '  {}  {}  1  {}  {}  {}  {}  {}  {}'
     
     # comparaments - array of class CfastComparament
     # wallvents - array of class CfastWallvents
-    def __init__(self, comparaments:list, wallvents:list, ink_self) -> None:
+    # name - имя исходного документа, по умолчанию берется из ink_self
+    # comps_index - готовый индекс помещений CfastBuilding.comps_index()
+    # ceilvents - array of class CfastCeilingVent
+    def __init__(self, comparaments:list, wallvents:list, ink_self=None, name:str=None, comps_index:dict=None,
+                 ceilvents:list=None) -> None:
         self.comparaments = comparaments
         self.wallvents = wallvents
         self.ink_self = ink_self
+        self.name = name if name is not None else ink_self.svg.name
+        self.comps_index = comps_index
+        self.ceilvents = ceilvents or []
+
+    @classmethod
+    def from_building(cls, building):
+        return cls(building.comparaments, building.wallvents, name=building.name, comps_index=building.comps_index(),
+                   ceilvents=building.ceilvents)
     
     def to_string(self) -> str:
-        content = self.ZONE.format(self.ink_self.svg.name.replace('smv', 'svg')) + LR
-        
-        r = lambda item: round(item, 4)
+        return ''.join(line + LR for line in self.lines())
+
+    '''
+    Построчная генерация содержимого файла
+    '''
+    def lines(self):
+        yield self.ZONE.format(self.name.replace('smv', 'svg'))
         
-        comps_dict = dict()
+        comps_dict = self.comps_index if self.comps_index is not None else dict()
         for i, comp in enumerate(self.comparaments):
-            content += self.ROOM + LR
-            content += '  {}  {}  {}'.format(comp.width, comp.depth, comp.height) + LR
-            content += '  {}  {}  {}'.format(comp.origin[0], comp.origin[1], comp.origin[2]) + LR
-            comps_dict[comp.id] = (i+1, comp)
+            yield from self.room_lines(comp)
+            if self.comps_index is None:
+                comps_dict[comp.id] = (i+1, comp)
         
         for wallvent in self.wallvents:
-            content += self.HVENTPOS + LR
+            yield self.HVENTPOS
             wv_cidx  = wallvent.comp_ids
             from_obj = comps_dict[wv_cidx[0]]
             from_idx:int = from_obj[0]
@@ -60,47 +81,143 @@ class SmvFile():
             else:
                 to_idx = comps_dict[wv_cidx[1]][0]
 
-            comp:CfastComparament = from_obj[1]
-            face = wallvent.face
-            offset = wallvent.offset
-            p1:CfastPoint = None
-            p2:CfastPoint = None
-            if face == CfastFace.FRONT:
-                p1 = CfastPoint(offset,                 0, wallvent.bottom)
-                p2 = CfastPoint(p1.x + wallvent.width,  0, wallvent.top)
-            elif face == CfastFace.REAR:
-                p1 = CfastPoint(comp.width - offset,    comp.depth, wallvent.bottom)
-                p2 = CfastPoint(p1.x - wallvent.width,  p1.y,       wallvent.top)
-            elif face == CfastFace.LEFT:
-                p1 = CfastPoint(0, comp.depth - offset,     wallvent.bottom)
-                p2 = CfastPoint(0, p1.y - wallvent.width,   wallvent.top)
-            elif face == CfastFace.RIGHT:
-                p1 = CfastPoint(comp.width, offset,                 wallvent.bottom)
-                p2 = CfastPoint(p1.x,       p1.y + wallvent.width,  wallvent.top)
-
-            content += '  {}  {}  {}  {}  {}  {}  {}  {}'.format(from_idx, to_idx,
-                                                                 r(p1.x), r(p2.x), 
-                                                                 r(p1.y), r(p2.y),
-                                                                 r(p1.z), r(p2.z)
-                                                                 ) + LR
-
-        return content
+            yield self.HVENT.format(from_idx, to_idx, *self.hvent_coordinates(from_obj[1], wallvent))
 
-class ExportCfastGeometry(inkex.OutputExtension):
-    select_all = (ShapeElement,)
+        for ceilvent in self.ceilvents:
+            from_idx, to_idx, coordinates = self.vvent_record(comps_dict, ceilvent)
+            yield self.VVENTPOS
+            yield self.VVENT.format(from_idx, len(comps_dict) if to_idx is None else to_idx, *coordinates)
 
-    def save(self, stream):
-        comps, w_vents = CfastProcessing().mapping(self.svg.selection.filter(ShapeElement).values())
+    @classmethod
+    def room_lines(cls, comp:CfastComparament):
+        yield cls.ROOM
+        yield '  {}  {}  {}'.format(comp.width, comp.depth, comp.height)
+        yield '  {}  {}  {}'.format(comp.origin[0], comp.origin[1], comp.origin[2])
+
+    '''
+    Координаты проема относительно помещения comp, от которого он отсчитывается
+    '''
+    @staticmethod
+    def hvent_coordinates(comp:CfastComparament, wallvent) -> tuple:
+        r = lambda item: round(item, 4)
+        face = wallvent.face
+        offset = wallvent.offset
+        p1:CfastPoint = None
+        p2:CfastPoint = None
+        if face == CfastFace.FRONT:
+            p1 = CfastPoint(offset,                 0, wallvent.bottom)
+            p2 = CfastPoint(p1.x + wallvent.width,  0, wallvent.top)
+        elif face == CfastFace.REAR:
+            p1 = CfastPoint(comp.width - offset,    comp.depth, wallvent.bottom)
+            p2 = CfastPoint(p1.x - wallvent.width,  p1.y,       wallvent.top)
+        elif face == CfastFace.LEFT:
+            p1 = CfastPoint(0, comp.depth - offset,     wallvent.bottom)
+            p2 = CfastPoint(0, p1.y - wallvent.width,   wallvent.top)
+        elif face == CfastFace.RIGHT:
+            p1 = CfastPoint(comp.width, offset,                 wallvent.bottom)
+            p2 = CfastPoint(p1.x,       p1.y + wallvent.width,  wallvent.top)
+
+        return r(p1.x), r(p2.x), r(p1.y), r(p2.y), r(p1.z), r(p2.z)
+
+    '''
+    Номера помещений и координаты проема в перекрытии
+
+    Проем отсчитывается от верхнего помещения (от нижнего, если верхнего нет) и
+    записывается квадратом площади проема с центром в OFFSETS. Для нижнего помещения
+    проем лежит в его потолке. Номер помещения "снаружи" - None
+    '''
+    @staticmethod
+    def vvent_record(comps_dict:dict, ceilvent) -> tuple:
+        r = lambda item: round(item, 4)
+        top, bottom = ceilvent.comp_ids
+        from_idx, comp = comps_dict[top if top is not None else bottom]
+        to_idx = comps_dict[bottom][0] if top is not None and bottom is not None else None
+        z = 0 if top is not None else comp.height
+        half = ceilvent.area ** 0.5 / 2
+        x, y = ceilvent.offsets
+        return from_idx, to_idx, (r(x - half), r(x + half), r(y - half), r(y + half), z, z)
+
+    '''
+    Потоковая запись файла без формирования всего содержимого в памяти
+    '''
+    def write_to(self, stream, encoding:str='utf-8') -> None:
+        write_lines(stream, self.lines(), encoding)
+
+class SmvStreamFile:
+    '''
+    Потоковая запись файла Smokeview по этажам
+
+    Помещения этажа записываются сразу, проемы - во временный файл с номерами помещений.
+    Номер помещения "снаружи" равен количеству помещений здания, поэтому проемы наружу
+    получают его только при записи в конце файла. Номера помещений предыдущего этажа
+    хранятся до следующего этажа для проемов в перекрытии. Результат совпадает с SmvFile
+
+    end - текст, который записывается после всех проемов
+    '''
+    def __init__(self, stream, name:str, encoding:str='utf-8', end:str=''):
+        self.stream = stream
+        self.name = name
+        self.encoding = encoding
+        self.end = end
+        self.spool = CfastSpool()
+        self.ceil_spool = CfastSpool()
+        self.below = {}
+        self.comparaments = 0
+        self.wallvents = 0
+        self.ceilvents = 0
+
+    def begin(self) -> None:
+        write_lines(self.stream, (SmvFile.ZONE.format(self.name.replace('smv', 'svg')),), self.encoding)
 
-        smv_content = SmvFile(comps, w_vents, self).to_string()
-        stream.write("{}\n".format(smv_content).encode('utf-8'))
+    def add_level(self, comparaments:list, wallvents:list, registry, ceilvents:list=()) -> None:
+        comps_dict = {}
+        for comp in comparaments:
+            write_lines(self.stream, SmvFile.room_lines(comp), self.encoding)
+            self.comparaments += 1
+            comps_dict[comp.id] = (self.comparaments, comp)
+
+        def records():
+            for wallvent in wallvents:
+                from_idx, comp = comps_dict[wallvent.comp_ids[0]]
+                to_idx = comps_dict[wallvent.comp_ids[1]][0] if len(wallvent.comp_ids) > 1 else None
+                yield registry.keys[wallvent.id], (from_idx, to_idx, SmvFile.hvent_coordinates(comp, wallvent))
+        self.spool.add_run(records())
+        self.wallvents += len(wallvents)
+
+        levels_dict = dict(self.below, **comps_dict)
+        self.ceil_spool.add_run((registry.keys[ceilvent.id], SmvFile.vvent_record(levels_dict, ceilvent))
+                                for ceilvent in ceilvents)
+        self.ceilvents += len(ceilvents)
+        self.below = comps_dict
+
+    def finish(self) -> None:
+        def lines():
+            for from_idx, to_idx, coordinates in self.spool.merged():
+                yield SmvFile.HVENTPOS
+                yield SmvFile.HVENT.format(from_idx, self.comparaments if to_idx is None else to_idx, *coordinates)
+            for from_idx, to_idx, coordinates in self.ceil_spool.merged():
+                yield SmvFile.VVENTPOS
+                yield SmvFile.VVENT.format(from_idx, self.comparaments if to_idx is None else to_idx, *coordinates)
+        write_lines(self.stream, lines(), self.encoding)
+        self.stream.write(self.end.encode(self.encoding))
+        self.spool.close()
+        self.ceil_spool.close()
+
+class ExportCfastGeometry(inkex.OutputExtension):
+    def save(self, stream):
+        export_extension(self, lambda export: self.save_building(export, stream))
 
-        self.msg('Экспорт данных успешно произведен')
-        self.msg('=================================')
-        self.msg('Количество помещений: {}'.format(len(comps)))
-        self.msg('Количество проемов: {}'.format(len(w_vents)))
-        self.msg('---------------------------------')
-        self.msg(smv_content)
+    def save_building(self, export:CfastExtensionExport, stream) -> CfastExportSummary:
+        if os.environ.get(STREAM_ENV) == '1':
+            smv_file = SmvStreamFile(stream, self.svg.name, end=LR)
+            export.stream([smv_file])
+            return CfastExportSummary(smv_file.comparaments, smv_file.wallvents, smv_file.ceilvents, preview=())
+        building = export.building(default_name=None)
+        smv_file = SmvFile.from_building(building)
+        with export.phase():
+            smv_file.write_to(stream)
+            stream.write(LR.encode('utf-8'))
+        return CfastExportSummary.of_building(building, preview=smv_file.lines())
     
 
 if __name__ == '__main__':
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Shared pytest fixtures: sample drawings in tests/fixtures and an environment
+without the user's CFAST_* settings
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+sys.path.insert(0, ROOT)
+
+'''
+Путь к чертежу из tests/fixtures
+'''
+def fixture_path(name:str) -> str:
+    return os.path.join(FIXTURES, name)
+
+# Настройки пользователя не влияют на тесты, а кэш пишется во временную директорию
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch, tmp_path):
+    for key in list(os.environ):
+        if key.startswith('CFAST_'):
+            monkeypatch.delenv(key)
+    monkeypatch.setenv('CFAST_CACHE_DIR', str(tmp_path / 'cache'))
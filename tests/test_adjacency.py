@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Room adjacency by shared walls: sweep over the sides of each line
+"""
+
+import json
+import random
+
+from conftest import fixture_path
+from cfast_batch_export import load_document
+from cfast_adjacency import CfastAdjacency, shared_walls, main
+from export_cfast_geometry import CfastProcessing, Segment
+
+def building(name:str, snap:int=0):
+    return CfastProcessing(snap=snap).building(load_document(fixture_path(name)), name)
+
+'''
+Общие стены полным перебором пар помещений в целых миллиметрах
+'''
+def brute_force(rects:list) -> set:
+    mm = lambda value: int(round(value * 1000))
+    walls = set()
+    for a, ax, ay, aw, ad in rects:
+        for b, bx, by, bw, bd in rects:
+            if mm(ax + aw) == mm(bx):
+                start, end = max(mm(ay), mm(by)), min(mm(ay + ad), mm(by + bd))
+                if end > start:
+                    walls.add((a, b, Segment.VERTICAL, mm(bx), start, end))
+            if mm(ay + ad) == mm(by):
+                start, end = max(mm(ax), mm(bx)), min(mm(ax + aw), mm(bx + bw))
+                if end > start:
+                    walls.add((a, b, Segment.HORISONTAL, mm(by), start, end))
+    return walls
+
+def as_set(walls:list) -> set:
+    mm = lambda value: int(round(value * 1000))
+    return {(w.comp_ids[0], w.comp_ids[1], w.orientation, mm(w.coordinate), mm(w.start), mm(w.end)) for w in walls}
+
+def test_levels_are_separate():
+    graph = CfastAdjacency.from_building(building('two_levels.svg'))
+    assert sorted(graph.edges()) == [('rect1', 'rect2', 3.0), ('rect4', 'rect3', 4.0)]
+    assert [w.level for w in graph.walls_between('rect1', 'rect2')] == ['level1']
+    assert graph.walls_between('rect1', 'rect3') == []
+
+def test_rounding_mismatch_is_a_shared_wall():
+    # Нижняя сторона rect1 и верхняя сторона rect2 расходятся на 1 мм из-за округления
+    graph = CfastAdjacency.from_building(building('snap.svg'))
+    assert graph.edges() == [('rect2', 'rect1', 4.0)]
+    assert 'rect3' not in graph.neighbours()
+
+def test_snap_joins_walls_with_a_gap():
+    # Между rect1 и rect3 зазор 3 мм: стена видна с допуском касания, но не без него
+    graph = CfastAdjacency.from_building(building('snap.svg', snap=2), snap=2)
+    assert sorted(graph.neighbours()['rect1']) == ['rect2', 'rect3']
+    wall, = graph.walls_between('rect1', 'rect3')
+    assert wall.orientation == Segment.VERTICAL
+    assert round(wall.length, 3) == 3.031
+
+def test_sweep_matches_brute_force():
+    rnd = random.Random(7)
+    rects = []
+    for i in range(120):
+        col, row = i % 12, i // 12
+        # Комнаты в ряду разной ширины, ряды сдвинуты, чтобы стены перекрывались частично
+        rects.append(('rect{}'.format(i + 1), col * 2.5 + (row % 2) * 0.75, row * 2.0,
+                      2.5 if rnd.random() < 0.8 else 1.25, 2.0))
+    assert as_set(shared_walls(rects)) == brute_force(rects)
+
+def test_command_line_json(tmp_path):
+    out = tmp_path / 'adjacency.json'
+    assert main([fixture_path('two_rooms.svg'), '-o', str(out)]) == 0
+    data = json.loads(out.read_text(encoding='utf-8'))
+    assert data['edges'] == [['rect1', 'rect2', 3.0]]
+    assert data['walls'][0]['orientation'] == 'vertical'
+
+def test_chained_sides_do_not_join_distant_walls():
+    # Стороны rect1 (x = 1.000) и rect2 (x = 1.003) разделены зазором 3 мм. Стороны rect3 (x = 1.001)
+    # и rect4 (x = 1.002) на других участках этажа связывают их в одну цепочку, но не в одну стену
+    rects = [('rect1', 0.0, 0.0, 1.0, 2.0), ('rect2', 1.003, 0.0, 1.0, 2.0),
+             ('rect3', 0.0, 5.0, 1.001, 1.0), ('rect4', 1.002, 10.0, 1.0, 1.0)]
+    assert shared_walls(rects) == []
+
+def test_wall_coordinate_comes_from_matched_sides():
+    rects = [('rect1', 0.0, 0.0, 1.0, 2.0), ('rect2', 1.001, 0.0, 1.0, 2.0), ('rect3', 1.002, 5.0, 1.0, 1.0)]
+    wall, = shared_walls(rects)
+    assert wall.comp_ids == ('rect1', 'rect2')
+    assert wall.coordinate == 1.0005
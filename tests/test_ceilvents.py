@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ceiling openings between linked levels: CEILING and VVENTPOS records
+"""
+
+import io
+
+from conftest import fixture_path
+from cfast_batch_export import load_document
+from cfast_model import write_model, read_model
+from export_cfast_bundle import FORMATS, STREAM_FORMATS
+from export_cfast_geometry import CfastProcessing, CfastFile
+from export_cfast_shards import shard_building
+
+NAME = 'openings.svg'
+
+def building():
+    return CfastProcessing().building(load_document(fixture_path(NAME)), NAME)
+
+def ceilvents(items:list) -> dict:
+    return {ceilvent.id: (ceilvent.comp_ids, ceilvent.area, ceilvent.offsets) for ceilvent in items}
+
+'''
+Проем rect20 этажа 2 соединяет rect3 с rect1 ниже, под проемом rect21 нет верхнего помещения,
+проем rect22 в полу первого этажа ведет наружу вниз. Второй этаж привязан к первому точками spot1 и spot2
+'''
+def test_comp_ids_and_offsets():
+    assert ceilvents(building().ceilvents) == {
+        # Центр отсчитывается от угла верхнего помещения rect3 (0.5, -3.0)
+        'rect20': (['rect3', 'rect1'], 1.0, (1.0, 1.5)),
+        # Верхнего помещения нет: центр отсчитывается от нижнего помещения rect2 (4.0, -3.0)
+        'rect21': ([None, 'rect2'], 0.4, (1.4, 2.25)),
+        'rect22': (['rect1', None], 0.24, (0.5, 2.6)),
+    }
+
+def test_cfast_records():
+    content = CfastFile([], [], ceilvents=building().ceilvents).to_string()
+    assert "&VENT TYPE = 'CEILING' ID = 'rect20'\n      COMP_IDS = 'rect3', 'rect1'\n" \
+           "      AREA = 1.0 SHAPE = 'SQUARE' OFFSETS = 1.0, 1.5 /" in content
+    assert "COMP_IDS = 'OUTSIDE', 'rect2'" in content
+    assert "COMP_IDS = 'rect1', 'OUTSIDE'" in content
+
+def test_smv_records():
+    stream = io.BytesIO()
+    FORMATS['smv'](stream, building())
+    lines = stream.getvalue().decode('utf-8').split('\n')
+    assert lines.count('VVENTPOS') == 3
+
+def test_stream_equals_in_memory():
+    for fmt in ('in', 'smv'):
+        expected = io.BytesIO()
+        FORMATS[fmt](expected, building())
+        streamed = io.BytesIO()
+        CfastProcessing().stream(load_document(fixture_path(NAME)), [STREAM_FORMATS[fmt](streamed, NAME)])
+        assert streamed.getvalue() == expected.getvalue(), fmt
+
+def test_model_round_trip():
+    original = building()
+    stream = io.BytesIO()
+    write_model(stream, original)
+    restored = read_model(stream.getvalue())
+    assert ceilvents(restored.ceilvents) == ceilvents(original.ceilvents)
+    assert CfastFile(restored.comparaments, restored.wallvents, ceilvents=restored.ceilvents).to_string() == \
+           CfastFile(original.comparaments, original.wallvents, ceilvents=original.ceilvents).to_string()
+
+def test_shards_cut_ceiling_openings():
+    # Этажи не помещаются в одну часть из двух помещений, проем rect20 разрезается
+    lower, upper = shard_building(building(), limit=2)
+    assert [comp.id for comp in lower.comparaments] == ['rect1', 'rect2']
+    assert ceilvents(lower.ceilvents)['rect20'] == ([None, 'rect1'], 1.0, (1.5, 1.5))
+    assert ceilvents(upper.ceilvents) == {'rect20': (['rect3', None], 1.0, (1.0, 1.5))}
+    assert [b[:3] for b in lower.boundary] == [('rect20', 'rect1', 'rect3')]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export daemon and client: private socket, client environment and in-process fallback
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import fixture_path
+from cfast_client import main, served, request, is_private, SOCKET_ENV
+from cfast_daemon import client_context, serve
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Unix sockets are not supported')
+
+SCRIPT = '--script=export_cfast_geometry'
+
+@pytest.fixture
+def private_dir(tmp_path):
+    path = tmp_path / 'run'
+    path.mkdir(mode=0o700)
+    return path
+
+'''
+Демон в отдельном потоке на сокете в private_dir; после теста демон останавливается
+'''
+@pytest.fixture
+def daemon(private_dir, monkeypatch):
+    path = str(private_dir / 'daemon.sock')
+    monkeypatch.setenv(SOCKET_ENV, path)
+    thread = threading.Thread(target=serve, args=(path,), daemon=True)
+    thread.start()
+    for _ in range(200):
+        if request({'command': 'ping'}, timeout=1.0) is not None:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail('daemon did not start')
+    yield path
+    # Тест мог перенаправить клиента на другой сокет
+    monkeypatch.setenv(SOCKET_ENV, path)
+    assert request({'command': 'stop'}, timeout=5.0) is not None
+    thread.join(5.0)
+
+def export(tmp_path, name:str) -> bytes:
+    out = tmp_path / name
+    assert main([SCRIPT, fixture_path('two_rooms.svg'), '--output={}'.format(out)]) == 0
+    return out.read_bytes()
+
+def test_client_context_uses_only_client_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('CFAST_JOBS', '4')
+    monkeypatch.setenv('CFAST_SNAP', '1')
+    cwd = os.getcwd()
+    with client_context(str(tmp_path), {'CFAST_SNAP': '2'}):
+        assert 'CFAST_JOBS' not in os.environ
+        assert os.environ['CFAST_SNAP'] == '2'
+        assert os.getcwd() == str(tmp_path)
+    assert os.environ['CFAST_JOBS'] == '4'
+    assert os.environ['CFAST_SNAP'] == '1'
+    assert os.getcwd() == cwd
+
+def test_socket_must_be_private(private_dir):
+    path = str(private_dir / 'daemon.sock')
+    assert not is_private(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        assert is_private(path)
+        os.chmod(str(private_dir), 0o777)
+        assert not is_private(path)
+
+def test_regular_file_is_not_a_socket(private_dir):
+    path = private_dir / 'daemon.sock'
+    path.write_text('')
+    path.chmod(0o600)
+    assert not is_private(str(path))
+
+def test_client_falls_back_without_daemon(tmp_path, private_dir, monkeypatch, capsys):
+    monkeypatch.setenv(SOCKET_ENV, str(private_dir / 'missing.sock'))
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+    assert served('export_cfast_geometry', [fixture_path('two_rooms.svg')]) is None
+    output = export(tmp_path, 'in_process.in')
+    assert 'Демон CFAST не запущен' in capsys.readouterr().err
+    assert b"ID = 'rect10'" in output
+
+def test_daemon_export_matches_in_process(tmp_path, daemon, monkeypatch, capsys):
+    served_output = export(tmp_path, 'served.in')
+    assert 'Демон CFAST:' in capsys.readouterr().err
+
+    monkeypatch.setenv(SOCKET_ENV, daemon + '.missing')
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+    assert export(tmp_path, 'in_process.in') == served_output
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export extensions run through the shared save scaffold (export_extension)
+"""
+
+import pytest
+
+from conftest import fixture_path
+from export_cfast_geometry import ExportCfastGeometry
+from export_smv_geometry import ExportCfastGeometry as ExportSmvGeometry
+from export_cfast_bundle import ExportCfastBundle
+from export_cfast_shards import ExportCfastShards
+from export_cfast_model import ExportCfastModel
+
+@pytest.mark.parametrize('cls', [ExportCfastGeometry, ExportSmvGeometry, ExportCfastBundle,
+                                 ExportCfastShards, ExportCfastModel])
+@pytest.mark.parametrize('stream', ['0', '1'])
+def test_extension_exports_and_reports(cls, stream, tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv('CFAST_STREAM', stream)
+    out = tmp_path / 'out'
+    cls().run([fixture_path('openings.svg'), '--output={}'.format(out)])
+    messages = capsys.readouterr().err
+    assert out.stat().st_size > 0
+    assert 'Экспорт данных успешно произведен' in messages
+    assert 'Количество помещений: 3' in messages
+    assert 'Количество проемов в перекрытиях: 3' in messages
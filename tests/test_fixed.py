@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Integer millimetre geometry and the snap tolerance of contacts
+"""
+
+import cfast_fixed
+from conftest import fixture_path
+from cfast_batch_export import load_document
+from export_cfast_geometry import CfastProcessing
+
+def vents(snap:int=None) -> dict:
+    building = CfastProcessing(snap=snap).building(load_document(fixture_path('snap.svg')), 'snap.svg')
+    return {vent.id: vent for vent in building.wallvents}
+
+def test_box_size_does_not_depend_on_offset():
+    # Одинаковые прямоугольники после смещения этажа остаются одинаковыми
+    for dx in (0.0, 0.0004, 12.3456, -7.0005):
+        x0, y0, x1, y1 = cfast_fixed.box_of(1.0 + dx, 2.0 - dx, 3.0015, 0.9995)
+        assert (x1 - x0, y1 - y0) == (cfast_fixed.to_units(3.0015), cfast_fixed.to_units(0.9995))
+
+def test_wallvent_side_with_snap():
+    comp = cfast_fixed.box_of(0.0, 0.0, 4.0, 3.0)
+    # Дверь заканчивается в 2 мм от правой стены помещения
+    vent = cfast_fixed.box_of(3.9, 1.0, 0.098, 0.8)
+    assert cfast_fixed.wallvent_side(vent, comp) is None
+    assert cfast_fixed.wallvent_side(vent, comp, snap=2) == (1, 800, 1000)
+
+def test_rounding_mismatch_is_a_contact():
+    # Стены rect1 и rect2 расходятся на 1 мм, дверь rect10 все равно соединяет помещения
+    door = vents(snap=0)['rect10']
+    assert door.comp_ids == ['rect1', 'rect2']
+    assert (door.face, door.width, door.offset) == ('FRONT', 0.8, 1.5)
+
+def test_gap_is_closed_only_by_snap():
+    # Между rect1 и rect3 зазор 3 мм, угол двери rect11 не доходит до rect3 на 1 мм
+    assert vents(snap=0)['rect11'].comp_ids == ['rect1']
+    assert vents(snap=2)['rect11'].comp_ids == ['rect1', 'rect3']
+
+def test_snap_from_environment(monkeypatch):
+    monkeypatch.setenv(cfast_fixed.SNAP_ENV, '2')
+    assert cfast_fixed.snap_from_env() == 2
+    assert vents()['rect11'].comp_ids == ['rect1', 'rect3']
+    monkeypatch.setenv(cfast_fixed.SNAP_ENV, 'x')
+    assert cfast_fixed.snap_from_env() == cfast_fixed.DEFAULT_SNAP
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-level mapping cache: reuse of unchanged levels, invalidation and save errors
+"""
+
+import os
+import shutil
+
+from conftest import fixture_path
+from cfast_batch_export import load_document
+from cfast_mapping_cache import CfastMappingCache, open_cache, save_cache, CACHE_ENV
+from export_cfast_geometry import CfastProcessing, CfastFile
+
+def export(svg_path:str, cache=None, snap:int=0) -> str:
+    building = CfastProcessing(snap=snap).building(load_document(svg_path), os.path.basename(svg_path), cache)
+    return CfastFile(building.comparaments, building.wallvents, ceilvents=building.ceilvents).to_string()
+
+'''
+Копия чертежа, в которой изменен только второй этаж: помещение rect4 стало глубже
+'''
+def changed_copy(tmp_path) -> str:
+    path = str(tmp_path / 'two_levels.svg')
+    with open(fixture_path('two_levels.svg'), encoding='utf-8') as f:
+        content = f.read()
+    room = '<rect id="rect4" x="0" y="300" width="400" height="200"'
+    assert room in content
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content.replace(room, '<rect id="rect4" x="0" y="300" width="400" height="250"'))
+    return path
+
+def test_unchanged_levels_are_restored_from_cache(tmp_path):
+    path = str(tmp_path / 'cache.cfastcache')
+    svg = fixture_path('two_levels.svg')
+
+    cache = CfastMappingCache(path)
+    expected = export(svg, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert cache.save()
+
+    cache = CfastMappingCache(path)
+    assert export(svg, cache) == expected
+    assert (cache.hits, cache.misses) == (2, 0)
+
+def test_changed_level_is_mapped_again(tmp_path):
+    path = str(tmp_path / 'cache.cfastcache')
+    cache = CfastMappingCache(path)
+    export(fixture_path('two_levels.svg'), cache)
+    cache.save()
+
+    changed = changed_copy(tmp_path)
+    cache = CfastMappingCache(path)
+    result = export(changed, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert result == export(changed)
+    assert result != export(fixture_path('two_levels.svg'))
+
+def test_snap_is_part_of_the_key(tmp_path):
+    cache = CfastMappingCache(str(tmp_path / 'cache.cfastcache'))
+    export(fixture_path('two_levels.svg'), cache, snap=0)
+    export(fixture_path('two_levels.svg'), cache, snap=5)
+    assert (cache.hits, cache.misses) == (0, 4)
+
+def test_document_cache_lives_in_cache_dir(tmp_path):
+    svg = str(tmp_path / 'two_levels.svg')
+    shutil.copy(fixture_path('two_levels.svg'), svg)
+    cache = open_cache(svg)
+    export(svg, cache)
+    assert cache.save()
+    assert os.path.dirname(cache.path) == str(tmp_path / 'cache')
+    # Рядом с документом файлов кэша нет
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'two_levels.svg']
+
+def test_cache_can_be_disabled(monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, '0')
+    assert open_cache(fixture_path('two_levels.svg')) is None
+
+def test_save_error_is_a_warning(tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    cache = CfastMappingCache(str(blocker / 'cache.cfastcache'))
+    export(fixture_path('two_levels.svg'), cache)
+
+    warnings = []
+    save_cache(cache, warnings.append)
+    assert cache.error is not None
+    assert len(warnings) == 1 and warnings[0].startswith('Кэш не сохранен')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2021 bvchirkov
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Validation of the drawing: the full problem list and warnings before export
+"""
+
+import pytest
+
+import inkex
+from conftest import fixture_path
+from cfast_batch_export import load_document
+from cfast_validation import validate, validated, VALIDATE_ENV
+from export_cfast_geometry import ExportCfastGeometry
+
+def test_all_problems_are_reported():
+    problems = [(p.level, p.message, p.ids) for p in validate(load_document(fixture_path('invalid.svg')))]
+    assert problems == [
+        ('level1', 'идентификатор прямоугольника должен иметь вид rect<N>', ('room_x',)),
+        ('level1', 'пересечение помещений', ('rect1', 'rect2')),
+        ('level1', 'дверь не касается ни одного помещения', ('rect10',)),
+        ('level1', 'в помещении находится только один угол двери', ('rect11', 'rect2')),
+    ]
+
+def test_valid_drawing_has_no_problems():
+    assert validate(load_document(fixture_path('two_levels.svg'))) == []
+
+def test_problems_are_warnings_before_export(monkeypatch):
+    monkeypatch.setenv(VALIDATE_ENV, '1')
+    warnings = []
+    exported = False
+    with validated(load_document(fixture_path('invalid.svg')), warnings.append):
+        exported = True
+    assert exported
+    assert warnings[1] == 'Найдено ошибок: 4'
+    assert any('rect10' in line for line in warnings)
+
+def test_no_check_before_export_by_default():
+    warnings = []
+    with validated(load_document(fixture_path('invalid.svg')), warnings.append):
+        pass
+    assert warnings == []
+
+def test_valid_drawing_is_exported_silently(monkeypatch):
+    monkeypatch.setenv(VALIDATE_ENV, '1')
+    warnings = []
+    with validated(load_document(fixture_path('two_levels.svg')), warnings.append):
+        pass
+    assert warnings == []
+
+def test_failed_export_lists_all_problems():
+    with pytest.raises(inkex.AbortExtension) as error:
+        with validated(load_document(fixture_path('invalid.svg'))):
+            raise KeyError('rect10')
+    assert 'Найдено ошибок: 4' in str(error.value)
+    assert 'room_x' in str(error.value)
+
+def test_other_errors_are_not_replaced():
+    # Ошибка записи не связана с чертежом и выводится как есть
+    with pytest.raises(OSError):
+        with validated(load_document(fixture_path('invalid.svg'))):
+            raise OSError('disk full')
+
+'''
+Экспорт чертежа с дверью вне помещений с проверкой перед экспортом:
+ошибка выводится, но экспорт выполняется
+'''
+def test_extension_warns_and_exports(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv(VALIDATE_ENV, '1')
+    svg = tmp_path / 'stray_door.svg'
+    content = open(fixture_path('two_rooms.svg'), encoding='utf-8').read()
+    door = '<rect id="rect11"'
+    svg.write_text(content.replace(door, '<rect id="rect12" x="900" y="100" width="10" height="80" '
+                                         'style="fill:none;stroke:#000000"/>\n      ' + door), encoding='utf-8')
+    out = tmp_path / 'stray_door.in'
+    ExportCfastGeometry().run([str(svg), '--output={}'.format(out)])
+    messages = capsys.readouterr().err
+    assert 'дверь не касается ни одного помещения (rect12)' in messages
+    assert 'Экспорт данных успешно произведен' in messages
+    assert "ID = 'rect10'" in out.read_text(encoding='utf-8')